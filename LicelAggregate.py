@@ -0,0 +1,323 @@
+"""Time binned statistics of range corrected profiles over many Licel files.
+
+Files are grouped by ``GlobalInfo.StartTime`` into fixed time bins (hourly,
+daily or any number of seconds). For every time bin and dataset a
+:class:`ChannelState` accumulates count, sum and a fixed size histogram per
+range bin, so memory does not grow with the number of files. The histogram
+is stored sparse, only occupied cells are kept, and gives approximate
+medians and percentiles. States of different workers are
+merged by adding them, which lets :func:`aggregate_files` spread the files of
+a time bin over several processes. Time bins are finalized one after the
+other, so only the compact results of finished bins are kept.
+"""
+import argparse
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from LicelReader import TIME_FORMAT, LicelFileReader
+from LicelUtil import downsampling, pr2
+
+BIN_SECONDS = {'hour': 3600, 'day': 86400}
+
+
+def start_time(file: LicelFileReader) -> datetime:
+    """Return ``GlobalInfo.StartTime`` as UTC datetime."""
+    return file.GlobalInfo.getTimes()[0].replace(tzinfo=timezone.utc)
+
+
+def time_bin(file: LicelFileReader, bin_seconds: int) -> int:
+    """Return the start of the time bin of the file in seconds since the epoch."""
+    t = int(start_time(file).timestamp())
+    return t - t % bin_seconds
+
+
+_start_re = re.compile(rb'(\d{2}/\d{2}/\d{4}) (\d{2}:\d{2}:\d{2})')
+
+
+def read_time_bin(filename: str, bin_seconds: int) -> int:
+    """Like :func:`time_bin` but only reads the header lines instead of the whole file."""
+    with open(filename, 'rb') as fp:
+        fp.readline()
+        match = _start_re.search(fp.readline())
+    if not match:
+        raise ValueError(f"No start time in header of '{filename}'")
+    t = datetime.strptime((match.group(1) + b' ' + match.group(2)).decode(), TIME_FORMAT)
+    t = int(t.replace(tzinfo=timezone.utc).timestamp())
+    return t - t % bin_seconds
+
+
+@dataclass
+class SketchConfig:
+    """Fixed histogram edges shared by all states that are to be merged.
+
+    The values are binned in ``asinh(value / scale)`` so positive and negative
+    values over many decades get a roughly constant relative resolution.
+    """
+    numBins: int = 1000
+    scale: float = 1.0
+    limit: float = 1e12
+
+    def edges(self) -> np.ndarray:
+        top = np.arcsinh(self.limit / self.scale)
+        return np.linspace(-top, top, self.numBins + 1)
+
+
+@dataclass
+class ChannelState:
+    """Mergeable partial statistics of one dataset in one time bin.
+
+    The histogram is sparse: ``cells`` holds the sorted flat indices
+    ``range bin * sketch.numBins + histogram bin`` of the occupied cells and
+    ``cellCounts`` their counts. The values of one range bin rarely spread
+    over a few histogram bins, so this is much smaller than the dense
+    ``range bins x sketch.numBins`` table it stands for.
+    """
+    sketch: SketchConfig
+    x_axis_m: np.ndarray
+    count: np.ndarray
+    total: np.ndarray
+    cells: np.ndarray
+    cellCounts: np.ndarray
+
+    @classmethod
+    def empty(cls, sketch: SketchConfig, x_axis_m: np.ndarray) -> 'ChannelState':
+        n = x_axis_m.size
+        return cls(sketch, x_axis_m, np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.float64),
+                   np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+    def _add_cells(self, cells: np.ndarray, counts: np.ndarray):
+        cells, inverse = np.unique(np.concatenate([self.cells, cells]), return_inverse=True)
+        self.cellCounts = np.bincount(inverse, np.concatenate([self.cellCounts, counts]),
+                                      minlength=cells.size).astype(np.int64)
+        self.cells = cells
+
+    def add(self, profile: np.ndarray):
+        if profile.size != self.count.size:
+            raise ValueError(f"profile has {profile.size} bins, the state {self.count.size}")
+        n = profile.size
+        valid = np.isfinite(profile)
+        self.count[:n] += valid
+        self.total[:n] += np.where(valid, profile, 0.0)
+        top = np.arcsinh(self.sketch.limit / self.sketch.scale)
+        pos = (np.arcsinh(profile / self.sketch.scale) + top) / (2 * top) * self.sketch.numBins
+        idx = np.clip(np.nan_to_num(pos, nan=0.0).astype(np.int64), 0, self.sketch.numBins - 1)
+        rows = np.arange(n)[valid]
+        self._add_cells(rows * self.sketch.numBins + idx[valid], np.ones(rows.size, dtype=np.int64))
+
+    def merge(self, other: 'ChannelState') -> 'ChannelState':
+        if other.sketch != self.sketch or other.count.size != self.count.size:
+            raise ValueError('cannot merge states with different sketch or range layout')
+        self.count += other.count
+        self.total += other.total
+        self._add_cells(other.cells, other.cellCounts)
+        return self
+
+    def mean(self) -> np.ndarray:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, self.total / self.count, np.nan)
+
+    def percentile(self, q: float) -> np.ndarray:
+        """Approximate percentile ``q`` (0..100) per range bin, linear within a histogram bin."""
+        edges = self.sketch.edges()
+        rows = self.cells // self.sketch.numBins
+        cum = np.cumsum(self.cellCounts)
+        # cumulated counts within the range bin of each cell
+        first = np.searchsorted(rows, np.arange(self.count.size))
+        cum -= np.concatenate([[0], cum])[first][rows]
+        target = q / 100.0 * self.count
+        # cells are sorted, the first cell reaching the target is the first of its row
+        reached = np.flatnonzero(cum >= target[rows])
+        hit_rows, at = np.unique(rows[reached], return_index=True)
+        cell = reached[at]
+        k = self.cells[cell] % self.sketch.numBins
+        inside = self.cellCounts[cell]
+        frac = np.clip((target[hit_rows] - (cum[cell] - inside)) / inside, 0.0, 1.0)
+        value = np.full(self.count.size, np.nan)
+        value[hit_rows] = self.sketch.scale * np.sinh(edges[k] + frac * (edges[k + 1] - edges[k]))
+        return np.where(self.count > 0, value, np.nan)
+
+
+@dataclass
+class AggregateSettings:
+    """Processing applied to every profile before it is accumulated.
+
+    ``t0``, ``start`` and ``stop`` are passed to :func:`LicelUtil.pr2`,
+    ``exponent`` to :func:`LicelUtil.downsampling` (0 keeps the bins).
+    ``channels`` selects datasets by their short description, empty means
+    all analog and photon counting datasets. Time bins with more than
+    ``chunk_files`` files are split over several workers and merged.
+    """
+    bin_seconds: int = 3600
+    chunk_files: int = 32
+    t0: int = 0
+    start: int = -1000
+    stop: int = -1
+    exponent: int = 0
+    channels: List[str] = field(default_factory=list)
+    sketch: SketchConfig = field(default_factory=SketchConfig)
+
+
+# time bin start, dataset index, descriptor (e.g. BT0), short description, numBins and binWidth
+StateKey = Tuple[int, int, str, str, int, float]
+
+
+def accumulate(files: Iterable[str], settings: AggregateSettings) -> Dict[StateKey, ChannelState]:
+    """Accumulate the files into partial states, one per time bin and dataset.
+
+    Datasets are told apart by index and descriptor, the short description
+    alone does not separate e.g. two transient recorders on one wavelength.
+    A change of ``numBins`` or ``binWidth`` within a time bin starts a new state.
+    """
+    states: Dict[StateKey, ChannelState] = {}
+    factor = 1 << settings.exponent
+    for filename in files:
+        file = LicelFileReader(filename)
+        t = time_bin(file, settings.bin_seconds)
+        for i, (ds, descr) in enumerate(zip(file.dataSet, file.shortDescr)):
+            if ds.dataType >= 4 or ds.numBins < factor:
+                continue
+            if settings.channels and descr not in settings.channels:
+                continue
+            profile = pr2(ds.physData, settings.t0, settings.start, settings.stop)
+            if settings.exponent > 0:
+                profile = downsampling(profile, settings.exponent)
+            key = (t, i, ds.descriptor, descr, ds.numBins, ds.binWidth)
+            state = states.get(key)
+            if state is None:
+                x = ds.x_axis_m()[::factor][:profile.size]
+                state = states[key] = ChannelState.empty(settings.sketch, x)
+            state.add(profile)
+    return states
+
+
+def merge_states(parts: Iterable[Dict[StateKey, ChannelState]]) -> Dict[StateKey, ChannelState]:
+    merged: Dict[StateKey, ChannelState] = {}
+    for part in parts:
+        for key, state in part.items():
+            if key in merged:
+                merged[key].merge(state)
+            else:
+                merged[key] = state
+    return merged
+
+
+@dataclass
+class AggregateResult:
+    """Statistics of one dataset in one time bin."""
+    time: datetime
+    channel: str
+    dataset: int
+    descriptor: str
+    numBins: int
+    binWidth: float
+    x_axis_m: np.ndarray
+    count: np.ndarray
+    mean: np.ndarray
+    median: np.ndarray
+    percentiles: Dict[float, np.ndarray]
+
+
+def finalize(states: Dict[StateKey, ChannelState],
+             percentiles: Sequence[float] = (5, 25, 75, 95)) -> List[AggregateResult]:
+    results = []
+    for (t, dataset, descriptor, channel, numBins, binWidth), state in sorted(states.items(), key=lambda kv: kv[0]):
+        results.append(AggregateResult(
+            time=datetime.fromtimestamp(t, tz=timezone.utc),
+            channel=channel,
+            dataset=dataset,
+            descriptor=descriptor,
+            numBins=numBins,
+            binWidth=binWidth,
+            x_axis_m=state.x_axis_m,
+            count=state.count,
+            mean=state.mean(),
+            median=state.percentile(50),
+            percentiles={q: state.percentile(q) for q in percentiles},
+        ))
+    return results
+
+
+def aggregate_files(files: Sequence[str], settings: Optional[AggregateSettings] = None,
+                    percentiles: Sequence[float] = (5, 25, 75, 95),
+                    workers: int = 1) -> List[AggregateResult]:
+    """Compute time binned statistics of the range corrected profiles.
+
+    Parameters
+    ----------
+    files: Sequence[str]
+        Licel data files, in any order
+    settings: AggregateSettings
+        time bin length and profile processing
+    percentiles: Sequence[float]
+        percentiles reported next to mean and median
+    workers: int
+        number of worker processes, 1 runs in the calling process
+
+    Returns
+    -------
+    List[AggregateResult] :
+        one entry per time bin and dataset, sorted by time
+    """
+    settings = settings or AggregateSettings()
+    bins: Dict[int, List[str]] = {}
+    for filename in files:
+        bins.setdefault(read_time_bin(filename, settings.bin_seconds), []).append(filename)
+    tasks = []
+    for t in sorted(bins):
+        names = bins[t]
+        for i in range(0, len(names), settings.chunk_files):
+            tasks.append((t, names[i:i + settings.chunk_files]))
+
+    results: List[AggregateResult] = []
+    pending: Dict[StateKey, ChannelState] = {}
+    pending_bin = None
+
+    def consume(parts):
+        nonlocal pending, pending_bin
+        for (t, _), part in zip(tasks, parts):
+            if t != pending_bin:
+                results.extend(finalize(pending, percentiles))
+                pending, pending_bin = {}, t
+            pending = merge_states([pending, part])
+        results.extend(finalize(pending, percentiles))
+
+    if workers <= 1 or len(tasks) <= 1:
+        consume(accumulate(names, settings) for _, names in tasks)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            consume(pool.map(accumulate, [names for _, names in tasks], [settings] * len(tasks)))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='time binned pr2 statistics of Licel files')
+    parser.add_argument('directory')
+    parser.add_argument('--bin', default='hour', help='hour, day or seconds')
+    parser.add_argument('--exponent', type=int, default=0)
+    parser.add_argument('--t0', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--out', default='aggregate.npz')
+    args = parser.parse_args()
+    bin_seconds = BIN_SECONDS[args.bin] if args.bin in BIN_SECONDS else int(args.bin)
+    names = sorted(os.path.join(args.directory, n) for n in os.listdir(args.directory))
+    names = [n for n in names if os.path.isfile(n)]
+    res = aggregate_files(names, AggregateSettings(bin_seconds=bin_seconds, t0=args.t0,
+                                                   exponent=args.exponent), workers=args.workers)
+    out = {}
+    for r in res:
+        prefix = (f"{r.time:%Y%m%dT%H%M%S}_{r.descriptor}_{r.channel.replace(' ', '_')}"
+                  f"_{r.numBins}x{r.binWidth:g}m")
+        out[prefix + '_range'] = r.x_axis_m
+        out[prefix + '_count'] = r.count
+        out[prefix + '_mean'] = r.mean
+        out[prefix + '_median'] = r.median
+        for q, values in r.percentiles.items():
+            out[f"{prefix}_p{q:g}"] = values
+    np.savez(args.out, **out)
+    print(f"{len(res)} time bin / dataset combinations written to {args.out}")
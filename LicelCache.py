@@ -0,0 +1,345 @@
+"""Shared memory profile cache for several analysis processes on one host.
+
+A :class:`ProfileCacheService` owns the shared memory segments and an LRU
+index keyed by path, mtime and size. Clients connect with
+:class:`ProfileCache` and get a :class:`CachedProfile` whose ``rawData`` and
+``physData`` arrays are read only NumPy views into the shared segment, so a
+file decoded by one process is not parsed again by the others.
+
+Start the service once per host::
+
+    python LicelCache.py --budget-mb 512
+"""
+import argparse
+import copy
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import resource_tracker
+from multiprocessing.managers import BaseManager
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from LicelReader import GlobalInfo, LicelFileReader, dataSet
+
+DEFAULT_ADDRESS = ('127.0.0.1', 50088)
+DEFAULT_AUTHKEY = b'LicelCache'
+DEFAULT_BUDGET = 256 * 1024 * 1024
+# seconds after which a reservation that was never committed is dropped
+PENDING_TIMEOUT = 60.0
+
+
+def _attach(name: str) -> SharedMemory:
+    """Attach to an existing segment without handing it to our resource tracker."""
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    shm = SharedMemory(name=name)
+    # before 3.13 attaching registers the segment as if we had created it,
+    # the tracker would then unlink it when this process exits
+    if os.name == 'posix':
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def _alive(pid: int) -> bool:
+    """False if the process is known to be gone, clients run on the same host."""
+    if os.name != 'posix':
+        # os.kill would terminate the process on Windows, rely on the timeout
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _CacheIndex:
+    """LRU index living in the service process, it creates and unlinks all segments.
+
+    The manager serves every client connection in its own thread, all
+    methods hold ``_lock``. A reservation records the pid of the client and
+    the time, it is dropped when the client died or did not commit within
+    ``pending_timeout`` seconds, so a crashed worker does not keep its
+    budget or block the key.
+    """
+
+    def __init__(self, budget: int, pending_timeout: float = PENDING_TIMEOUT):
+        self.budget = budget
+        self.pending_timeout = pending_timeout
+        self.used = 0
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, dict]' = OrderedDict()
+        self._segments: Dict[str, SharedMemory] = {}
+        self._counter = 0
+
+    def lookup(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['meta'] is None:
+                return None
+            self._entries.move_to_end(key)
+            return {'name': entry['name'], 'meta': entry['meta']}
+
+    def reserve(self, key: str, nbytes: int, pid: int = 0) -> Optional[str]:
+        """Create a segment for ``key``, None if it is pending elsewhere or too large."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._stale(entry):
+                self._release(self._entries.pop(key))
+            if key in self._entries or nbytes > self.budget:
+                return None
+            self._evict(nbytes)
+            if self.used + nbytes > self.budget:
+                return None
+            self._counter += 1
+            name = f"licel_{os.getpid()}_{self._counter}"
+            self._segments[name] = SharedMemory(name=name, create=True, size=max(nbytes, 1))
+            self._entries[key] = {'name': name, 'nbytes': nbytes, 'meta': None,
+                                  'pid': pid, 'reserved': time.monotonic()}
+            self.used += nbytes
+            return name
+
+    def commit(self, key: str, name: str, meta: bytes):
+        """Publish the filled segment, ignored if the reservation was dropped meanwhile."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['name'] == name and entry['meta'] is None:
+                entry['meta'] = meta
+
+    def discard(self, key: str, name: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['name'] == name:
+                self._release(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            # every segment ever created and not yet unlinked, entries or not
+            for shm in self._segments.values():
+                shm.close()
+                shm.unlink()
+            self._segments.clear()
+            self.used = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'used': self.used, 'budget': self.budget}
+
+    def _stale(self, entry: dict) -> bool:
+        if entry['meta'] is not None:
+            return False
+        if time.monotonic() - entry['reserved'] > self.pending_timeout:
+            return True
+        return entry['pid'] > 0 and not _alive(entry['pid'])
+
+    def _evict(self, nbytes: int):
+        for key in [k for k, e in self._entries.items() if self._stale(e)]:
+            self._release(self._entries.pop(key))
+        for key in list(self._entries):
+            if self.used + nbytes <= self.budget:
+                break
+            if self._entries[key]['meta'] is None:
+                continue
+            self._release(self._entries.pop(key))
+
+    def _release(self, entry: dict):
+        self.used -= entry['nbytes']
+        shm = self._segments.pop(entry['name'], None)
+        if shm is not None:
+            # processes still attached keep their mapping, only the name goes away
+            shm.close()
+            shm.unlink()
+
+
+_index: Optional[_CacheIndex] = None
+
+
+def _init_index(budget: int):
+    global _index
+    _index = _CacheIndex(budget)
+
+
+def _get_index() -> _CacheIndex:
+    return _index
+
+
+class _CacheManager(BaseManager):
+    pass
+
+
+_CacheManager.register('get_index', callable=_get_index)
+
+
+class ProfileCacheService:
+    """Run the cache index in a child process.
+
+    Parameters
+    ----------
+    address: tuple or str
+        address the manager listens on, any process on the host that knows it
+        and the ``authkey`` can use the cache
+    authkey: bytes
+        authentication key of the manager connection
+    budget_bytes: int
+        upper limit for the summed size of all cached segments, the least
+        recently used profiles are unlinked first
+    """
+
+    def __init__(self, address: Union[Tuple[str, int], str] = DEFAULT_ADDRESS,
+                 authkey: bytes = DEFAULT_AUTHKEY, budget_bytes: int = DEFAULT_BUDGET):
+        self.budget_bytes = budget_bytes
+        self._manager = _CacheManager(address=address, authkey=authkey)
+
+    @property
+    def address(self):
+        return self._manager.address
+
+    def start(self):
+        self._manager.start(_init_index, (self.budget_bytes,))
+
+    def shutdown(self):
+        self._manager.get_index().clear()
+        self._manager.shutdown()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+class CachedProfile:
+    """Decoded Licel file backed by a shared memory segment.
+
+    Offers the attributes of :class:`LicelFileReader` (``GlobalInfo``,
+    ``dataSet``, ``shortDescr``). The data arrays are read only views, call
+    :meth:`close` (or use it as context manager) when done with them.
+    """
+
+    get_overflow_for_dataset = LicelFileReader.get_overflow_for_dataset
+
+    def __init__(self, shm: SharedMemory, meta: bytes):
+        self._shm = shm
+        info, datasets, self.shortDescr, layout = pickle.loads(meta)
+        self.GlobalInfo: GlobalInfo = info
+        self.dataSet: List[dataSet] = datasets
+        for ds, (raw_offset, phys_offset) in zip(self.dataSet, layout):
+            ds.rawData = np.ndarray((ds.numBins,), dtype=np.uint32, buffer=shm.buf, offset=raw_offset)
+            ds.physData = np.ndarray((ds.numBins,), dtype=np.float64, buffer=shm.buf, offset=phys_offset)
+            ds.rawData.flags.writeable = False
+            ds.physData.flags.writeable = False
+
+    def close(self):
+        """Drop the array views and detach from the segment."""
+        if self._shm is None:
+            return
+        for ds in self.dataSet:
+            ds.rawData = np.zeros(0, dtype=np.uint32)
+            ds.physData = np.zeros(0, dtype=np.float64)
+        self._shm.close()
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _layout(reader: LicelFileReader) -> Tuple[List[Tuple[int, int]], int]:
+    """Byte offsets of raw and phys data per dataset, float64 blocks kept 8 byte aligned."""
+    layout = []
+    offset = 0
+    for ds in reader.dataSet:
+        raw_offset = offset
+        offset += (4 * ds.numBins + 7) & ~7
+        layout.append((raw_offset, offset))
+        offset += 8 * ds.numBins
+    return layout, offset
+
+
+class ProfileCache:
+    """Client side of the profile cache.
+
+    Parameters
+    ----------
+    address: tuple or str
+        address of a running :class:`ProfileCacheService`
+    authkey: bytes
+        authentication key of the service
+    """
+
+    def __init__(self, address: Union[Tuple[str, int], str] = DEFAULT_ADDRESS,
+                 authkey: bytes = DEFAULT_AUTHKEY):
+        self._manager = _CacheManager(address=address, authkey=authkey)
+        self._manager.connect()
+        self._index = self._manager.get_index()
+
+    @staticmethod
+    def key(filename: str) -> str:
+        st = os.stat(filename)
+        return f"{os.path.abspath(filename)}|{st.st_mtime_ns}|{st.st_size}"
+
+    def get(self, filename: str) -> Union[CachedProfile, LicelFileReader]:
+        """Return the decoded file, from the cache if another process already read it.
+
+        On a miss the file is parsed and published. If it cannot be cached
+        (larger than the budget, or another process is filling the same key)
+        the plain :class:`LicelFileReader` is returned.
+        """
+        key = self.key(filename)
+        entry = self._index.lookup(key)
+        if entry is not None:
+            try:
+                return CachedProfile(_attach(entry['name']), entry['meta'])
+            except FileNotFoundError:
+                # evicted between lookup and attach
+                pass
+        reader = LicelFileReader(filename)
+        layout, nbytes = _layout(reader)
+        name = self._index.reserve(key, nbytes, os.getpid())
+        if name is None:
+            return reader
+        try:
+            shm = _attach(name)
+            for ds, (raw_offset, phys_offset) in zip(reader.dataSet, layout):
+                np.ndarray((ds.numBins,), dtype=np.uint32, buffer=shm.buf, offset=raw_offset)[:] = ds.rawData
+                np.ndarray((ds.numBins,), dtype=np.float64, buffer=shm.buf, offset=phys_offset)[:] = ds.physData
+            datasets = []
+            for ds in reader.dataSet:
+                stripped = copy.copy(ds)
+                stripped.rawData = np.zeros(0, dtype=np.uint32)
+                stripped.physData = np.zeros(0, dtype=np.float64)
+                datasets.append(stripped)
+            meta = pickle.dumps((reader.GlobalInfo, datasets, reader.shortDescr, layout))
+        except BaseException:
+            self._index.discard(key, name)
+            raise
+        self._index.commit(key, name, meta)
+        return CachedProfile(shm, meta)
+
+    def stats(self) -> dict:
+        return self._index.stats()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='shared memory cache for decoded Licel files')
+    parser.add_argument('--host', default=DEFAULT_ADDRESS[0])
+    parser.add_argument('--port', type=int, default=DEFAULT_ADDRESS[1])
+    parser.add_argument('--budget-mb', type=int, default=DEFAULT_BUDGET // (1024 * 1024))
+    args = parser.parse_args()
+    _init_index(args.budget_mb * 1024 * 1024)
+    server = _CacheManager(address=(args.host, args.port), authkey=DEFAULT_AUTHKEY).get_server()
+    try:
+        server.serve_forever()
+    finally:
+        _index.clear()
@@ -0,0 +1,196 @@
+"""Detect the trigger bin t0 and a stable far range background window.
+
+Both detectors work on 2-D batches (profiles x bins). The background window
+is searched among overlapping far range windows, scored with rolling mean,
+variance and least squares slope computed from cumulative sums, so no loop
+over profiles or windows is needed. :class:`BackgroundDetector` caches the
+result per instrument configuration and feeds it into
+:func:`LicelKernels.pr2_batch`.
+"""
+import warnings
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from LicelReader import LicelFileReader
+from LicelKernels import pr2_batch, stack_raw
+
+
+_T0_NOISE_BINS = 20
+
+
+def detect_t0(batch: np.ndarray, search_bins: int = 200, min_snr: float = 10.0, default: int = 0) -> np.ndarray:
+    """ return the trigger bin of every profile
+
+    The trigger bin is the first bin after the steepest rise within the
+    first ``search_bins`` bins. The rise must exceed ``min_snr`` times the
+    noise of the bin to bin differences around it (scaled median absolute
+    deviation of the 20 differences on each side, the count noise of the
+    near range is much larger than that of the far range). Profiles without
+    such a rise, e.g. without pre-trigger bins, get ``default``.
+
+    Parameters
+    ----------
+    batch: np.ndarray
+        profiles x bins, 1-D input is treated as a single profile
+    search_bins: int
+        only the start of the profile is searched
+    min_snr: float
+        significance of the steepest rise in units of the difference noise
+    default: int
+        t0 of profiles without a significant rise
+
+    Returns
+    -------
+    np.ndarray :
+        t0 index per profile
+    """
+    batch = np.atleast_2d(batch)
+    head = batch[:, :max(min(search_bins, batch.shape[1]), 2)].astype(np.float64)
+    diff = np.diff(head, axis=1)
+    rows = np.arange(diff.shape[0])
+    steepest = np.argmax(diff, axis=1)
+    rise = diff[rows, steepest]
+    w = _T0_NOISE_BINS
+    padded = np.pad(diff, ((0, 0), (w, w)), constant_values=np.nan)
+    around = np.lib.stride_tricks.sliding_window_view(padded, 2 * w + 1, axis=1)[rows, steepest].copy()
+    around[:, w] = np.nan
+    with warnings.catch_warnings():
+        # profiles of two bins have no differences around the rise
+        warnings.simplefilter('ignore', RuntimeWarning)
+        centre = np.nanmedian(around, axis=1, keepdims=True)
+        noise = 1.4826 * np.nanmedian(np.abs(around - centre), axis=1)
+    noise = np.nan_to_num(noise, nan=0.0)
+    return np.where((rise > 0) & (rise > min_snr * noise), steepest + 1, default)
+
+
+def _window_stats(batch: np.ndarray, width: int, starts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Variance and slope t statistic of every window, both (profiles x windows)."""
+    y = batch - np.median(batch[:, batch.shape[1] // 2:], axis=1, keepdims=True)
+    j = np.arange(y.shape[1], dtype=np.float64)
+    zero = np.zeros((y.shape[0], 1))
+    s1 = np.concatenate([zero, np.cumsum(y, axis=1)], axis=1)
+    s2 = np.concatenate([zero, np.cumsum(y * y, axis=1)], axis=1)
+    sxy = np.concatenate([zero, np.cumsum(y * j, axis=1)], axis=1)
+    stops = starts + width
+    sum_y = s1[:, stops] - s1[:, starts]
+    sum_yy = s2[:, stops] - s2[:, starts]
+    sum_xy = sxy[:, stops] - sxy[:, starts]
+    mean_x = starts + (width - 1) / 2.0
+    var_x = (width * width - 1) / 12.0
+    mean_y = sum_y / width
+    var_y = np.maximum(sum_yy / width - mean_y * mean_y, 0.0)
+    cov = sum_xy / width - mean_x * mean_y
+    slope = cov / var_x
+    resid = np.maximum(var_y - slope * slope * var_x, 1e-300)
+    t = np.abs(slope) / np.sqrt(resid / (width * var_x))
+    return var_y, t
+
+
+def detect_background(batch: np.ndarray, width: int = 500, tail_skip: int = 1,
+                      t_max: float = 3.0, common: bool = True):
+    """ find a far range window without signal or trend
+
+    Windows of ``width`` bins in the far half of the profile are tested.
+    Windows whose least squares slope is significant (``|t| >= t_max``) are
+    rejected, of the others the one with the smallest variance is used.
+
+    Parameters
+    ----------
+    batch: np.ndarray
+        profiles x bins, 1-D input is treated as a single profile
+    width: int
+        window length in bins, reduced for short profiles
+    tail_skip: int
+        bins at the very end that are never used
+    t_max: float
+        limit of the slope t statistic
+    common: bool
+        True returns one window for the whole batch (median statistics),
+        False one window per profile
+
+    Returns
+    -------
+    Tuple :
+        (start, stop) as ints if ``common``, else two arrays
+    """
+    batch = np.atleast_2d(batch).astype(np.float64)
+    numBins = batch.shape[1]
+    last = numBins - max(tail_skip, 0)
+    width = max(min(width, last // 2), 2)
+    first = max(numBins // 2, 0)
+    if last - width < first:
+        first = max(last - width, 0)
+    starts = np.arange(first, last - width + 1, max(width // 4, 1))
+    var, t = _window_stats(batch, width, starts)
+    if common:
+        var = np.median(var, axis=0, keepdims=True)
+        t = np.median(t, axis=0, keepdims=True)
+    score = np.where(t < t_max, var, np.inf)
+    # nothing passes the slope test, fall back to the smallest variance
+    score = np.where(np.isinf(score).all(axis=1, keepdims=True), var, score)
+    best = starts[np.argmin(score, axis=1)]
+    if common:
+        return int(best[0]), int(best[0] + width)
+    return best, best + width
+
+
+@dataclass(frozen=True)
+class Detection:
+    t0: int
+    start: int
+    stop: int
+
+
+ConfigKey = Tuple[int, int, int, float, int, str]
+
+
+def config_key(file: LicelFileReader, ds_index: int) -> ConfigKey:
+    """Instrument configuration of one dataset, detections are shared between equal keys."""
+    ds = file.dataSet[ds_index]
+    return (ds_index, ds.dataType, ds.numBins, ds.binWidth, ds.wavelength, ds.descriptor)
+
+
+class BackgroundDetector:
+    """Detect t0 and background window once per instrument configuration.
+
+    Parameters
+    ----------
+    width: int
+        background window length in bins
+    search_bins: int
+        bins searched for t0
+    t_max: float
+        limit of the slope t statistic of the background window
+    t0: int
+        trigger bin used if the profiles show no significant rise
+    """
+
+    def __init__(self, width: int = 500, search_bins: int = 200, t_max: float = 3.0, t0: int = 0):
+        self.width = width
+        self.search_bins = search_bins
+        self.t_max = t_max
+        self.t0 = t0
+        self._cache: Dict[ConfigKey, Detection] = {}
+
+    def detect(self, files: Sequence[LicelFileReader], ds_index: int, refresh: bool = False) -> Detection:
+        """Return the detection for the dataset, computed from ``files`` on the first call."""
+        key = config_key(files[0], ds_index)
+        if not refresh and key in self._cache:
+            return self._cache[key]
+        batch = np.stack([f.dataSet[ds_index].physData for f in files])
+        t0 = int(np.median(detect_t0(batch, self.search_bins, default=self.t0)))
+        start, stop = detect_background(batch, self.width, t_max=self.t_max)
+        self._cache[key] = Detection(t0, start, stop)
+        return self._cache[key]
+
+    def pr2(self, files: Sequence[LicelFileReader], ds_index: int, deadtime_ns: float = 0.0,
+            t0: Optional[int] = None) -> np.ndarray:
+        """Range corrected batch with the detected t0 and background window."""
+        det = self.detect(files, ds_index)
+        raw, scale = stack_raw(files, ds_index)
+        return pr2_batch(raw, scale, det.t0 if t0 is None else t0, det.start, det.stop, deadtime_ns)
+
+    def clear(self):
+        self._cache.clear()
@@ -0,0 +1,320 @@
+"""Fused batch kernels for the hot paths of :mod:`LicelUtil`.
+
+The functions work on 2-D batches (profiles x bins) and do in one pass per
+profile what :mod:`LicelUtil` does in several NumPy passes:
+
+* :func:`pr2_batch` raw to phys scaling, dead time correction, background
+  offset and range correction
+* :func:`glue_batch` bin shift, dead time correction, toggle rate mask,
+  linear fit and gluing
+
+If Numba is installed the kernels are compiled and run in parallel over the
+profiles, otherwise a vectorized NumPy implementation is used. The backend
+can be chosen with :func:`set_backend` or the ``LICEL_BACKEND`` environment
+variable (``numba`` or ``numpy``).
+"""
+import os
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from LicelReader import LicelFileReader
+from LicelUtil import GluingStrategy
+
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+_backend = 'numba' if HAVE_NUMBA else 'numpy'
+
+# plain ints so the compiled kernels can use them
+_INVALID = GluingStrategy.INVALID.value
+_SIGNAL_TOO_LARGE = GluingStrategy.SIGNAL_TOO_LARGE.value
+_SIGNAL_TOO_WEAK = GluingStrategy.SIGNAL_TOO_WEAK.value
+_BACKGROUND = GluingStrategy.BACKGROUND.value
+_GLUE_PROFILES = GluingStrategy.GLUE_PROFILES.value
+
+
+def available_backends() -> List[str]:
+    return ['numba', 'numpy'] if HAVE_NUMBA else ['numpy']
+
+
+def set_backend(name: str):
+    """Select ``'numba'`` or ``'numpy'`` for all following calls."""
+    global _backend
+    if name not in available_backends():
+        raise ValueError(f"backend '{name}' not available, use one of {available_backends()}")
+    _backend = name
+
+
+def get_backend() -> str:
+    return _backend
+
+
+if os.environ.get('LICEL_BACKEND'):
+    set_backend(os.environ['LICEL_BACKEND'])
+
+
+def stack_raw(files: Sequence[LicelFileReader], ds_index: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Stack ``rawData`` of one dataset of several files into a batch.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray] :
+          raw counts (profiles x bins) and the raw to phys factor per profile
+    """
+    raw = np.stack([f.dataSet[ds_index].rawData for f in files])
+    scale = np.array([f.dataSet[ds_index].phys_scale() for f in files], dtype=np.float64)
+    return raw, scale
+
+
+def _bg_window(numBins: int, start: int, stop: int) -> Tuple[int, int]:
+    start, stop, _ = slice(start, stop).indices(numBins)
+    if stop <= start:
+        raise ValueError(f"empty background window {start}:{stop}")
+    return start, stop
+
+
+def _numpy_pr2(raw, scale, t0, start, stop, deadtime_ns):
+    phys = raw * scale[:, None]
+    if deadtime_ns > 0:
+        if np.max(phys) * deadtime_ns * 0.001 >= 1:
+            raise ValueError('dead time too large')
+        phys /= 1 - phys * deadtime_ns * 0.001
+    phys -= np.mean(phys[:, start:stop], axis=1, keepdims=True)
+    range_array = np.maximum(np.arange(-t0, raw.shape[1] - t0), np.ones(raw.shape[1]))
+    phys *= range_array * range_array
+    return phys
+
+
+def _numpy_glue(analog, pc, deadtime_ns, min_toggle, max_toggle, skip_bins):
+    if np.max(pc) * deadtime_ns * 0.001 >= 1:
+        raise ValueError('dead time too large')
+    pc_corr = pc / (1 - pc * deadtime_ns * 0.001)
+    pc_sk = pc_corr[:, skip_bins:]
+    pc_max = np.max(pc_sk, axis=1)
+    pc_min = np.min(pc_sk, axis=1)
+    # assigned from the lowest to the highest priority of check_gluing_strategy
+    strategy = np.full(pc.shape[0], _GLUE_PROFILES)
+    strategy[pc_min > min_toggle] = _BACKGROUND
+    strategy[pc_max < min_toggle] = _SIGNAL_TOO_WEAK
+    strategy[pc_min > max_toggle] = _SIGNAL_TOO_LARGE
+    strategy[(pc_max > 1000) | (pc_min < 0)] = _INVALID
+
+    mask = (pc_sk >= min_toggle) & (pc_sk <= max_toggle)
+    x = np.where(mask, analog[:, skip_bins:], 0.0)
+    y = np.where(mask, pc_sk, 0.0)
+    n = mask.sum(axis=1)
+    # no bin inside the toggle range, there is nothing to fit
+    strategy[(strategy == _GLUE_PROFILES) & (n == 0)] = _INVALID
+    sx, sy = x.sum(axis=1), y.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mx, my = sx / n, sy / n
+        sxx = np.sum(np.where(mask, (x - mx[:, None]) ** 2, 0.0), axis=1)
+        sxy = np.sum(np.where(mask, (x - mx[:, None]) * (y - my[:, None]), 0.0), axis=1)
+        m = np.where(sxx > 0, sxy / sxx, 0.0)
+        b = my - m * mx
+        fit_error = np.sum(np.where(mask, np.square(m[:, None] * x + b[:, None] - y), 0.0), axis=1) / n
+    glue = strategy == _GLUE_PROFILES
+    m = np.where(glue, m, 0.0)
+    b = np.where(glue, b, 0.0)
+    fit_error = np.where(glue, fit_error, 0.0)
+    use_analog = glue[:, None] & (pc_corr > max_toggle)
+    glued = np.where(use_analog, m[:, None] * analog + b[:, None], pc_corr)
+    return glued, m, b, fit_error, strategy
+
+
+if HAVE_NUMBA:
+    @njit(parallel=True, cache=True)
+    def _numba_pr2(raw, scale, t0, start, stop, deadtime_ns):
+        n, numBins = raw.shape
+        out = np.empty((n, numBins), dtype=np.float64)
+        k = deadtime_ns * 0.001
+        too_large = np.zeros(n, dtype=np.bool_)
+        for p in prange(n):
+            s = scale[p]
+            for j in range(numBins):
+                v = raw[p, j] * s
+                if k > 0:
+                    if v * k >= 1:
+                        too_large[p] = True
+                    v = v / (1 - v * k)
+                out[p, j] = v
+            acc = 0.0
+            for j in range(start, stop):
+                acc += out[p, j]
+            bg = acc / (stop - start)
+            for j in range(numBins):
+                r = max(j - t0, 1.0)
+                out[p, j] = (out[p, j] - bg) * r * r
+        return out, too_large
+
+    @njit(parallel=True, cache=True)
+    def _numba_glue(analog, pc, deadtime_ns, min_toggle, max_toggle, skip_bins):
+        n, numBins = pc.shape
+        k = deadtime_ns * 0.001
+        glued = np.empty((n, numBins), dtype=np.float64)
+        m_out = np.zeros(n)
+        b_out = np.zeros(n)
+        err_out = np.zeros(n)
+        strategy = np.empty(n, dtype=np.int64)
+        too_large = np.zeros(n, dtype=np.bool_)
+        for p in prange(n):
+            # pass 1: dead time correction, extremes and fit sums of the toggle range
+            pc_min = np.inf
+            pc_max = -np.inf
+            cnt = 0
+            sx = 0.0
+            sy = 0.0
+            for j in range(numBins):
+                v = pc[p, j]
+                if v * k >= 1:
+                    too_large[p] = True
+                v = v / (1 - v * k)
+                glued[p, j] = v
+                if j >= skip_bins:
+                    pc_min = min(pc_min, v)
+                    pc_max = max(pc_max, v)
+                    if v >= min_toggle and v <= max_toggle:
+                        cnt += 1
+                        sx += analog[p, j]
+                        sy += v
+            if pc_max > 1000 or pc_min < 0:
+                strategy[p] = _INVALID
+            elif pc_min > max_toggle:
+                strategy[p] = _SIGNAL_TOO_LARGE
+            elif pc_max < min_toggle:
+                strategy[p] = _SIGNAL_TOO_WEAK
+            elif pc_min > min_toggle:
+                strategy[p] = _BACKGROUND
+            else:
+                strategy[p] = _GLUE_PROFILES
+            if strategy[p] == _GLUE_PROFILES and cnt == 0:
+                # no bin inside the toggle range, there is nothing to fit
+                strategy[p] = _INVALID
+            if strategy[p] != _GLUE_PROFILES:
+                continue
+            # pass 2: centered least squares like np.polyfit(deg=1)
+            mx = sx / cnt
+            my = sy / cnt
+            sxx = 0.0
+            sxy = 0.0
+            for j in range(skip_bins, numBins):
+                v = glued[p, j]
+                if v >= min_toggle and v <= max_toggle:
+                    dx = analog[p, j] - mx
+                    sxx += dx * dx
+                    sxy += dx * (v - my)
+            m = sxy / sxx if sxx > 0 else 0.0
+            b = my - m * mx
+            # pass 3: fit error and gluing
+            err = 0.0
+            for j in range(numBins):
+                v = glued[p, j]
+                a = m * analog[p, j] + b
+                if j >= skip_bins and v >= min_toggle and v <= max_toggle:
+                    err += (a - v) * (a - v)
+                if v > max_toggle:
+                    glued[p, j] = a
+            m_out[p] = m
+            b_out[p] = b
+            err_out[p] = err / cnt
+        return glued, m_out, b_out, err_out, strategy, too_large
+
+
+def pr2_batch(raw: np.ndarray, scale, t0: int, start: int, stop: int,
+              deadtime_ns: float = 0.0) -> np.ndarray:
+    """ return range corrected profiles of a batch of raw data
+
+    Same as ``pr2(deadtime_correction(scale * raw, deadtime_ns), t0, start, stop)``
+    for every profile.
+
+    Parameters
+    ----------
+    raw: np.ndarray
+          raw counts (profiles x bins), 1-D input is treated as a single profile
+    scale: float or np.ndarray
+          raw to phys factor, scalar or one per profile (see :func:`stack_raw`)
+    t0: int
+          index of the t0 point
+    start: int
+          Start index for the background region, negative values count from the end
+    stop: int
+          Stop index for the background region
+    deadtime_ns: float
+          dead time for photon counting data, 0 skips the correction
+
+    Returns
+    -------
+    np.ndarray :
+          range corrected profiles (profiles x bins)
+    """
+    raw = np.atleast_2d(raw)
+    scale = np.broadcast_to(np.asarray(scale, dtype=np.float64), (raw.shape[0],))
+    start, stop = _bg_window(raw.shape[1], start, stop)
+    if _backend == 'numba':
+        out, too_large = _numba_pr2(np.ascontiguousarray(raw), np.ascontiguousarray(scale),
+                                    int(t0), start, stop, float(deadtime_ns))
+        if np.any(too_large):
+            raise ValueError('dead time too large')
+        return out
+    return _numpy_pr2(raw, scale, t0, start, stop, deadtime_ns)
+
+
+def glue_batch(analog: np.ndarray, pc_MHz: np.ndarray, binshift: int, deadtime_ns: float,
+               min_toggle: float, max_toggle: float,
+               skip_bins: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, List[GluingStrategy]]:
+    """ glue a batch of analog and photon counting profiles
+
+    Per profile the result matches :func:`LicelUtil.glue_profiles`.
+
+    Parameters
+    ----------
+    analog: np.ndarray
+          analog data (profiles x bins)
+    pc_MHz : np.ndarray
+          photon counting data in MHz (profiles x bins)
+    binshift: int
+          see :func:`LicelUtil.bin_shift`
+    deadtime_ns : float
+          The dead time of the detection system, typical values are 3.08 ns
+    min_toggle: float
+          lower count rate of the fit region in MHz
+    max_toggle: float
+          upper count rate of the fit region in MHz, above it the scaled analog is used
+    skip_bins: int
+          bins at the start excluded from the strategy check and the fit
+
+    Returns
+    -------
+    Tuple :
+          glued profiles in MHz, fit scale ``m``, fit offset ``b`` and fit error
+          per profile, and the :class:`LicelUtil.GluingStrategy` per profile.
+          Profiles that are not glued get the dead time corrected photon
+          counting and ``m = b = 0``. A profile without any bin inside the
+          toggle range cannot be fitted and is marked ``INVALID``.
+    """
+    analog = np.atleast_2d(analog).astype(np.float64, copy=False)
+    pc_MHz = np.atleast_2d(pc_MHz).astype(np.float64, copy=False)
+    if binshift > 0:
+        analog = analog[:, binshift:]
+        pc_MHz = pc_MHz[:, :pc_MHz.shape[1] - binshift]
+    elif binshift < 0:
+        analog = analog[:, :pc_MHz.shape[1] + binshift]
+        pc_MHz = pc_MHz[:, -binshift:]
+    skip_bins = max(skip_bins, 0)
+    if analog.shape[1] <= skip_bins:
+        n = analog.shape[0]
+        return (pc_MHz.copy(), np.zeros(n), np.zeros(n), np.zeros(n), [GluingStrategy.INVALID] * n)
+    if _backend == 'numba':
+        glued, m, b, err, strategy, too_large = _numba_glue(
+            np.ascontiguousarray(analog), np.ascontiguousarray(pc_MHz), float(deadtime_ns),
+            float(min_toggle), float(max_toggle), int(skip_bins))
+        if np.any(too_large):
+            raise ValueError('dead time too large')
+    else:
+        glued, m, b, err, strategy = _numpy_glue(analog, pc_MHz, deadtime_ns, min_toggle,
+                                                 max_toggle, skip_bins)
+    return glued, m, b, err, [GluingStrategy(int(s)) for s in strategy]
@@ -0,0 +1,243 @@
+"""Cloud and aerosol layer detection on batches of range corrected profiles.
+
+:func:`detect_layers` works on a (profiles x bins) ``pr2`` cube and returns
+a compact table with one row per layer (profile, base, peak and top height,
+peak value). Two methods are available:
+
+* ``gradient``: a layer starts where the range derivative exceeds
+  ``threshold`` robust standard deviations and ends where the falling edge
+  that follows is over, a rise followed by another rise or the end of the
+  profile instead of a falling edge is no layer
+* ``threshold``: an exponential clear air fit is removed from every profile,
+  a layer is every run of bins where the rest exceeds ``threshold`` noise
+  standard deviations. Bins above the fit are excluded and the fit is
+  repeated, so strong clouds do not pull it up.
+
+The noise of ``pr2`` grows with range, both methods therefore scale with a
+noise estimate taken from blocks of ``_NOISE_BLOCK`` bins (median absolute
+deviation, robust against layers covering less than half a block).
+
+The profiles can be preconditioned with a moving average (as
+:func:`LicelUtil.smoothed_signal`) and range binning (as
+:func:`LicelUtil.downsampling`), both applied to the whole batch at once.
+"""
+from typing import Optional
+
+import numpy as np
+
+LAYER_DTYPE = np.dtype([('profile', np.int32), ('base_m', np.float64), ('peak_m', np.float64),
+                        ('top_m', np.float64), ('peak_value', np.float64)])
+
+
+def smoothed_batch(batch: np.ndarray, filterWidth: int) -> np.ndarray:
+    """ moving average of every profile, same result as :func:`LicelUtil.smoothed_signal` per row """
+    batch = np.atleast_2d(batch).astype(np.float64)
+    if filterWidth <= 1:
+        return batch
+    n, numBins = batch.shape
+    left = filterWidth - 1 - (filterWidth - 1) // 2
+    right = (filterWidth - 1) // 2
+    padded = np.zeros((n, numBins + filterWidth))
+    padded[:, left + 1:left + 1 + numBins] = batch
+    cs = np.cumsum(padded, axis=1)
+    # np.convolve(mode='same') keeps output i at the centre of the window
+    return (cs[:, filterWidth:filterWidth + numBins] - cs[:, :numBins]) / filterWidth
+
+
+def downsampled_batch(batch: np.ndarray, exponent: int) -> np.ndarray:
+    """ sum groups of ``2**exponent`` bins, same result as :func:`LicelUtil.downsampling` per row """
+    batch = np.atleast_2d(batch)
+    factor = 1 << exponent
+    pieces = batch.shape[1] // factor
+    return batch[:, :pieces * factor].reshape(batch.shape[0], pieces, factor).sum(axis=2)
+
+
+_NOISE_BLOCK = 128
+
+
+def _local_scale(values: np.ndarray, block: int = _NOISE_BLOCK) -> np.ndarray:
+    """Robust standard deviation per block of bins, linearly interpolated to every bin."""
+    n, numBins = values.shape
+    block = max(min(block, numBins), 1)
+    numBlocks = numBins // block
+    blocks = values[:, :numBlocks * block].reshape(n, numBlocks, block)
+    med = np.median(blocks, axis=2, keepdims=True)
+    mad = 1.4826 * np.median(np.abs(blocks - med), axis=2)
+    # blocks without spread (e.g. clipped data) borrow the profile median
+    fallback = np.median(np.where(mad > 0, mad, np.nan), axis=1, keepdims=True) \
+        if np.any(mad > 0) else np.ones((n, 1))
+    mad = np.where(mad > 0, mad, np.nan_to_num(fallback, nan=1.0))
+    pos = np.clip((np.arange(numBins) + 0.5) / block - 0.5, 0, numBlocks - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, numBlocks - 1)
+    frac = pos - lo
+    return mad[:, lo] * (1 - frac) + mad[:, hi] * frac
+
+
+def _next_event(events: np.ndarray) -> np.ndarray:
+    """Index of the next True after every bin, the number of bins if there is none."""
+    n, numBins = events.shape
+    index = np.where(events, np.arange(numBins), numBins)
+    following = np.flip(np.minimum.accumulate(np.flip(index, axis=1), axis=1), axis=1)
+    return np.concatenate([following[:, 1:], np.full((n, 1), numBins)], axis=1)
+
+
+def _gradient_mask(s: np.ndarray, threshold: float) -> np.ndarray:
+    g = np.diff(s, axis=1, prepend=s[:, :1])
+    g = g / _local_scale(g)
+    idx = np.broadcast_to(np.arange(s.shape[1]), s.shape)
+    rising = g > threshold
+    falling = g < -threshold
+    rise_start = rising & ~np.roll(rising, 1, axis=1)
+    rise_start[:, 0] = rising[:, 0]
+    fall_end = ~falling & np.roll(falling, 1, axis=1)
+    fall_end[:, 0] = False
+    last_rise = np.maximum.accumulate(np.where(rise_start, idx, -1), axis=1)
+    last_fall_end = np.maximum.accumulate(np.where(fall_end, idx, -1), axis=1)
+    # a rise only starts a layer if a falling edge ends before the next rise starts,
+    # e.g. the rise of the overlap region is followed by the slow clear air decay
+    closed = _next_event(fall_end) < _next_event(rise_start)
+    rows = np.arange(s.shape[0])[:, None]
+    return (last_rise > last_fall_end) & closed[rows, np.maximum(last_rise, 0)]
+
+
+def _exp_fit(s: np.ndarray, x: np.ndarray, w: np.ndarray) -> np.ndarray:
+    """Weighted least squares of log(s), returns the fitted exponential."""
+    y = np.log(np.where(w > 0, s, 1.0))
+    n = w.sum(axis=1)
+    sx = (w * x).sum(axis=1)
+    sy = (w * y).sum(axis=1)
+    sxx = (w * x * x).sum(axis=1)
+    sxy = (w * x * y).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+        offset = (sy - slope * sx) / n
+    slope = np.nan_to_num(slope)
+    offset = np.nan_to_num(offset, nan=-np.inf)
+    return np.exp(offset[:, None] + slope[:, None] * x)
+
+
+def _clear_air(s: np.ndarray, x: np.ndarray, noise: np.ndarray, iterations: int = 20) -> np.ndarray:
+    """Exponential fit of every profile over the bins above the noise, bins well above the fit are dropped."""
+    # var(log s) ~ (noise / s)**2, so weight with (s / noise)**2
+    snr = np.where(s > 3 * noise, s / noise, 0.0)
+    w0 = snr * snr
+    keep = w0 > 0
+    fit = _exp_fit(s, x, w0)
+    for _ in range(iterations):
+        # a layer is a bump above the fit, its core is excluded first and the fit sinks towards clear air
+        new_keep = keep & (s - fit <= 3 * noise)
+        if np.array_equal(new_keep, keep):
+            break
+        keep = new_keep
+        fit = _exp_fit(s, x, np.where(keep, w0, 0.0))
+    return fit
+
+
+def _threshold_mask(s: np.ndarray, x: np.ndarray, threshold: float, noise: np.ndarray) -> np.ndarray:
+    return s - _clear_air(s, x, noise) > threshold * noise
+
+
+def detect_layers(batch: np.ndarray, x_axis_m: np.ndarray, method: str = 'gradient',
+                  threshold: float = 8.0, filterWidth: int = 0, exponent: int = 0,
+                  min_range_m: float = 0.0, max_range_m: Optional[float] = None,
+                  min_thickness_m: float = 0.0) -> np.ndarray:
+    """ detect layers in a batch of range corrected profiles
+
+    Parameters
+    ----------
+    batch: np.ndarray
+          pr2 profiles x bins, 1-D input is treated as a single profile
+    x_axis_m: np.ndarray
+          range of every bin in m, e.g. ``dataSet.x_axis_m()``
+    method: str
+          ``'gradient'`` or ``'threshold'``
+    threshold: float
+          gradient or signal threshold in units of the local noise standard deviation
+    filterWidth: int
+          moving average width for preconditioning, 0 or 1 disables it
+    exponent: int
+          range binning, see :func:`LicelUtil.downsampling`
+    min_range_m: float
+          layers below are ignored, e.g. the incomplete overlap region
+    max_range_m: float
+          layers above are ignored
+    min_thickness_m: float
+          thinner layers are dropped
+
+    Returns
+    -------
+    np.ndarray :
+          structured array with ``LAYER_DTYPE`` rows, sorted by profile and height
+    """
+    s = np.atleast_2d(batch).astype(np.float64)
+    x = np.asarray(x_axis_m, dtype=np.float64)[:s.shape[1]]
+    if exponent > 0:
+        s = downsampled_batch(s, exponent)
+        x = x[::1 << exponent][:s.shape[1]]
+    if method == 'threshold':
+        # noise of the values from the differences of neighbouring bins, before the smoothing averages it down
+        noise = _local_scale(np.diff(s, axis=1, prepend=s[:, :1])) / np.sqrt(2 * max(filterWidth, 1))
+    if filterWidth > 1:
+        s = smoothed_batch(s, filterWidth)
+    keep = (x >= min_range_m) & (x <= (np.inf if max_range_m is None else max_range_m))
+    if filterWidth > 1:
+        # the moving average is padded with zeros, the bins at both ends are biased
+        edge = filterWidth // 2
+        keep[:edge] = False
+        keep[keep.size - edge:] = False
+    s = s[:, keep]
+    x = x[keep]
+    if method == 'threshold':
+        noise = noise[:, keep]
+    if s.shape[1] < 2:
+        return np.zeros(0, dtype=LAYER_DTYPE)
+
+    if method == 'gradient':
+        mask = _gradient_mask(s, threshold)
+    elif method == 'threshold':
+        mask = _threshold_mask(s, x, threshold, noise)
+    else:
+        raise ValueError(f"unknown method '{method}'")
+
+    n, numBins = mask.shape
+    padded = np.zeros((n, numBins + 2), dtype=bool)
+    padded[:, 1:-1] = mask
+    profile, base = np.nonzero(padded[:, 1:-1] & ~padded[:, :-2])
+    _, top = np.nonzero(padded[:, 1:-1] & ~padded[:, 2:])
+    if profile.size == 0:
+        return np.zeros(0, dtype=LAYER_DTYPE)
+
+    # peak of every run with one reduceat over the flattened cube
+    flat = np.append(s.ravel(), 0.0)
+    bounds = np.empty(2 * profile.size, dtype=np.int64)
+    bounds[0::2] = profile * numBins + base
+    bounds[1::2] = profile * numBins + top + 1
+    peak_value = np.maximum.reduceat(flat, bounds)[0::2]
+    segment = np.zeros(flat.size, dtype=np.int64)
+    np.add.at(segment, bounds[0::2], 1)
+    np.add.at(segment, bounds[1::2], -1)
+    inside = np.cumsum(segment) > 0
+    run_id = np.cumsum(np.isin(np.arange(flat.size), bounds[0::2])) - 1
+    at_peak = np.nonzero(inside & (flat == peak_value[np.clip(run_id, 0, None)]))[0]
+    _, first = np.unique(run_id[at_peak], return_index=True)
+    peak = at_peak[first] - profile * numBins
+
+    table = np.zeros(profile.size, dtype=LAYER_DTYPE)
+    table['profile'] = profile
+    table['base_m'] = x[base]
+    table['peak_m'] = x[peak]
+    table['top_m'] = x[top]
+    table['peak_value'] = peak_value
+    if min_thickness_m > 0:
+        table = table[table['top_m'] - table['base_m'] >= min_thickness_m]
+    return table
+
+
+def cloud_base(table: np.ndarray, numProfiles: int) -> np.ndarray:
+    """ lowest layer base per profile in m, NaN for profiles without layer """
+    base = np.full(numProfiles, np.nan)
+    # table is sorted by height within a profile, so the first row wins
+    profiles, first = np.unique(table['profile'], return_index=True)
+    base[profiles] = table['base_m'][first]
+    return base
@@ -0,0 +1,240 @@
+"""Live monitor that redraws at a fixed frame rate independent of file arrival.
+
+New files are decoded as they arrive and only the latest profile of each
+configured dataset is kept for drawing, together with a rolling time-height
+buffer. Rendering happens at ``frameRate`` frames per second, so a burst of
+files never queues up redraws. With ``headless = True`` the figure is drawn
+with the Agg backend and written as rolling PNG/SVG snapshots, the time-height
+buffer is stored next to them as ``timeheight.npy``.
+"""
+import configparser
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+from matplotlib.figure import Figure
+
+from LicelReader import LicelFileReader
+from LicelDetect import BackgroundDetector
+from LicelLayers import LAYER_DTYPE, detect_layers
+
+
+@dataclass
+class MonitorConfig:
+    """Settings of the ``[Reader]`` section of ``LicelUDP.ini``."""
+    dataDir: str = '.'
+    ds: List[int] = field(default_factory=lambda: [0])
+    logPlot: bool = True
+    frameRate: float = 2.0
+    headless: bool = False
+    snapshotDir: str = 'snapshots'
+    snapshotFormat: str = 'png'
+    keepSnapshots: int = 10
+    historyLength: int = 360
+    ingest: str = 'udp'
+    layerDetection: bool = False
+    layerThreshold: float = 8.0
+
+    @classmethod
+    def from_ini(cls, filename: str = 'LicelUDP.ini') -> 'MonitorConfig':
+        config = configparser.ConfigParser()
+        config.read(filename)
+        reader = config['Reader']
+        numDataSets = int(reader['numDataSets'])
+        return cls(
+            dataDir=reader['dataDir'],
+            ds=[int(reader['ds' + str(i)]) for i in range(numDataSets)],
+            logPlot=reader.getboolean('logPlot', fallback=True),
+            frameRate=reader.getfloat('frameRate', fallback=2.0),
+            headless=reader.getboolean('headless', fallback=False),
+            snapshotDir=reader.get('snapshotDir', fallback='snapshots'),
+            snapshotFormat=reader.get('snapshotFormat', fallback='png'),
+            keepSnapshots=reader.getint('keepSnapshots', fallback=10),
+            historyLength=reader.getint('historyLength', fallback=360),
+            ingest=reader.get('ingest', fallback='udp').lower(),
+            layerDetection=reader.getboolean('layerDetection', fallback=False),
+            layerThreshold=reader.getfloat('layerThreshold', fallback=8.0),
+        )
+
+
+class LiveMonitor:
+    """Keep the latest profiles of the configured datasets and draw them at a fixed rate.
+
+    :meth:`update` may be called from any thread (e.g. the UDP receiver),
+    :meth:`render` and :meth:`run` must run in the thread owning the figure.
+    """
+
+    def __init__(self, config: MonitorConfig):
+        self.config = config
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._latest: Optional[LicelFileReader] = None
+        self._dirty = False
+        self._history: Optional[np.ndarray] = None
+        self._history_pos = 0
+        self._history_count = 0
+        self.filesReceived = 0
+        self.framesDrawn = 0
+        self._snapshot_index = 0
+        self._lines = []
+        self._image = None
+        self._layer_lines = []
+        self._detector = BackgroundDetector()
+        self.layers = np.zeros(0, dtype=LAYER_DTYPE)
+
+        if config.headless:
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            self.figure = Figure(figsize=(12, 8), dpi=100)
+            FigureCanvasAgg(self.figure)
+            os.makedirs(config.snapshotDir, exist_ok=True)
+        else:
+            import matplotlib.pyplot as plt
+            plt.ion()
+            self.figure = plt.figure(figsize=(12, 8))
+        self.axes, self.th_axes = self.figure.subplots(2, 1)
+
+    def update(self, filename: str):
+        """Decode a new file and store it as the latest state, no drawing is done here.
+
+        A damaged file keeps its complete datasets. Raises ValueError if a
+        configured dataset is missing, the previous state is then kept.
+        """
+        file = LicelFileReader(filename, salvage=True)
+        missing = [i for i in self.config.ds if i >= len(file.dataSet)]
+        if missing:
+            raise ValueError(f"'{filename}' has {len(file.dataSet)} complete datasets, "
+                             f"dataset {missing[0]} is configured")
+        profile = file.dataSet[self.config.ds[0]].physData
+        layers = self.layers
+        if self.config.layerDetection:
+            ds_index = self.config.ds[0]
+            layers = detect_layers(self._detector.pr2([file], ds_index), file.dataSet[ds_index].x_axis_m(),
+                                   threshold=self.config.layerThreshold, filterWidth=5)
+        with self._lock:
+            self._latest = file
+            self.layers = layers
+            self._dirty = True
+            self.filesReceived += 1
+            if self._history is None or self._history.shape[1] != profile.size:
+                self._history = np.full((self.config.historyLength, profile.size), np.nan)
+                self._history_pos = 0
+                self._history_count = 0
+            self._history[self._history_pos] = profile
+            self._history_pos = (self._history_pos + 1) % self.config.historyLength
+            self._history_count = min(self._history_count + 1, self.config.historyLength)
+
+    def time_height(self) -> np.ndarray:
+        """Return the time-height buffer of the first configured dataset, oldest profile first."""
+        with self._lock:
+            if self._history is None:
+                return np.zeros((0, 0))
+            rolled = np.roll(self._history, -self._history_pos, axis=0)
+            return rolled[self.config.historyLength - self._history_count:].copy()
+
+    def render(self) -> bool:
+        """Draw the latest state if it changed since the last frame."""
+        with self._lock:
+            if not self._dirty:
+                return False
+            file = self._latest
+            layers = self.layers.copy()
+            self._dirty = False
+        th = self.time_height()
+        self._draw_profiles(file, layers)
+        self._draw_time_height(file, th)
+        self.framesDrawn += 1
+        if self.config.headless:
+            self._write_snapshot(th)
+        else:
+            self.figure.canvas.draw_idle()
+        return True
+
+    def _draw_profiles(self, file: LicelFileReader, layers: np.ndarray):
+        ax = self.axes
+        if not self._lines:
+            for i in self.config.ds:
+                plot = ax.semilogy if self.config.logPlot else ax.plot
+                (ll, ) = plot(file.dataSet[i].x_axis_m(), file.dataSet[i].physData,
+                              label=file.dataSet[i].getShortDescr())
+                self._lines.append(ll)
+            ax.set_xlabel('m')
+            ax.legend(loc='upper right')
+        else:
+            for ll, i in zip(self._lines, self.config.ds):
+                ll.set_data(file.dataSet[i].x_axis_m(), file.dataSet[i].physData)
+            ax.relim()
+            ax.autoscale_view()
+        ax.set_title(file.GlobalInfo.filename)
+        for artist in self._layer_lines:
+            artist.remove()
+        self._layer_lines = [ax.axvspan(layer['base_m'], layer['top_m'], color='grey', alpha=0.3)
+                             for layer in layers]
+        dataType = file.dataSet[self.config.ds[0]].dataType
+        if dataType == 0:
+            ax.set_ylabel('V')
+        elif dataType == 1:
+            ax.set_ylabel('MHz')
+        else:
+            ax.set_ylabel('AU')
+
+    def _draw_time_height(self, file: LicelFileReader, th: np.ndarray):
+        if th.size == 0:
+            return
+        data = th.T
+        if self.config.logPlot:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                data = np.log10(np.where(data > 0, data, np.nan))
+        x_max = float(file.dataSet[self.config.ds[0]].x_axis_m()[-1]) if data.shape[0] else 0.0
+        extent = (0, th.shape[0], 0, x_max)
+        if self._image is None:
+            self._image = self.th_axes.imshow(data, aspect='auto', origin='lower',
+                                              extent=extent, interpolation='nearest')
+            self.th_axes.set_xlabel('profile')
+            self.th_axes.set_ylabel('m')
+        else:
+            self._image.set_data(data)
+            self._image.set_extent(extent)
+        finite = data[np.isfinite(data)]
+        if finite.size:
+            lo, hi = np.percentile(finite, [1, 99])
+            self._image.set_clim(lo, hi if hi > lo else lo + 1)
+
+    def _write_snapshot(self, th: np.ndarray):
+        ext = self.config.snapshotFormat
+        target = os.path.join(self.config.snapshotDir,
+                              f"monitor_{self._snapshot_index % self.config.keepSnapshots:03d}.{ext}")
+        self.figure.savefig(target, format=ext)
+        self._snapshot_index += 1
+        # latest files are replaced atomically so readers never see half written files
+        latest = os.path.join(self.config.snapshotDir, f"latest.{ext}")
+        shutil.copyfile(target, latest + '.tmp')
+        os.replace(latest + '.tmp', latest)
+        buffer = os.path.join(self.config.snapshotDir, 'timeheight.npy')
+        with open(buffer + '.tmp', 'wb') as fp:
+            np.save(fp, th.astype(np.float32))
+        os.replace(buffer + '.tmp', buffer)
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        """Render at ``frameRate`` until :meth:`stop` is called."""
+        period = 1.0 / self.config.frameRate if self.config.frameRate > 0 else 1.0
+        next_frame = time.monotonic()
+        while not self._stop.is_set():
+            self.render()
+            next_frame += period
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                if self.config.headless:
+                    self._stop.wait(delay)
+                else:
+                    # keeps the GUI responsive while waiting for the next frame
+                    self.figure.canvas.start_event_loop(delay)
+            else:
+                # we fell behind, skip the missed frames instead of catching up
+                next_frame = time.monotonic()
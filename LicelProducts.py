@@ -0,0 +1,183 @@
+"""Pair analog and photon counting datasets and compute multi channel products.
+
+Datasets are grouped into :class:`Channel` entries by ``wavelength``,
+``Polarization`` and ``laserPolarization``, the analog (``dataType`` 0) and
+photon counting (``dataType`` 1) dataset of a channel form a
+:class:`ChannelPair`. The mapping only depends on the descriptor layout of a
+file, it is resolved once per layout and cached.
+
+:class:`PairingEngine` turns a batch of files with the same layout into glued
+and background corrected signals (time x bins) per channel, from which
+:func:`depolarization` and :func:`ratio` are computed without per profile
+loops.
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from LicelReader import LicelFileReader
+from LicelKernels import glue_batch
+
+
+@dataclass(frozen=True)
+class Channel:
+    """Optical channel, field names as in :class:`LicelReader.dataSet`."""
+    wavelength: int
+    Polarization: str = 'o'
+    laserPolarization: int = 0
+
+
+@dataclass(frozen=True)
+class ChannelPair:
+    """Dataset indices of the analog and photon counting part of a channel, None if missing."""
+    channel: Channel
+    analog: Optional[int] = None
+    pc: Optional[int] = None
+
+
+LayoutKey = Tuple[Tuple[int, int, str, int, int], ...]
+
+
+def layout_key(file: LicelFileReader) -> LayoutKey:
+    """Descriptor layout of a file, files with the same key share the channel mapping."""
+    return tuple((ds.dataType, ds.wavelength, ds.Polarization, ds.laserPolarization, ds.numBins)
+                 for ds in file.dataSet)
+
+
+@lru_cache(maxsize=64)
+def _pairs_for_layout(layout: LayoutKey) -> Dict[Channel, ChannelPair]:
+    analog: Dict[Channel, int] = {}
+    pc: Dict[Channel, int] = {}
+    for i, (dataType, wavelength, polarization, laserPolarization, _) in enumerate(layout):
+        if dataType not in (0, 1) or wavelength <= 0:
+            continue
+        target = analog if dataType == 0 else pc
+        target.setdefault(Channel(wavelength, polarization, laserPolarization), i)
+    channels = sorted(set(analog) | set(pc), key=lambda c: (c.wavelength, c.Polarization, c.laserPolarization))
+    return {c: ChannelPair(c, analog.get(c), pc.get(c)) for c in channels}
+
+
+def resolve_pairs(file: LicelFileReader) -> Dict[Channel, ChannelPair]:
+    """Return the channel pairs of the file, cached per descriptor layout."""
+    return _pairs_for_layout(layout_key(file))
+
+
+def find_channel(pairs, wavelength: int, Polarization: str = 'o',
+                 laserPolarization: Optional[int] = None) -> Channel:
+    """Look up a channel by wavelength and polarization in a pair mapping or signal dict."""
+    for channel in pairs:
+        if channel.wavelength == wavelength and channel.Polarization == Polarization and \
+                (laserPolarization is None or channel.laserPolarization == laserPolarization):
+            return channel
+    raise KeyError(f"no channel {wavelength} nm {Polarization}")
+
+
+class PairingEngine:
+    """Glued and background corrected signals per channel for a batch of files.
+
+    Parameters
+    ----------
+    deadtime_ns : float
+        dead time of the photon counting, typical values are 3.08 ns
+    min_toggle: float
+        lower count rate in MHz of the analog to photon counting fit
+    max_toggle: float
+        upper count rate in MHz of the fit, above it the scaled analog is used
+    binshift: int
+        analog versus photon counting shift, see :func:`LicelUtil.bin_shift`
+    bg_start: int
+        Start index for the background region, negative values count from the end
+    bg_stop: int
+        Stop index for the background region
+    """
+
+    def __init__(self, deadtime_ns: float = 3.08, min_toggle: float = 0.5, max_toggle: float = 20.0,
+                 binshift: int = 0, bg_start: int = -1000, bg_stop: int = -1):
+        self.deadtime_ns = deadtime_ns
+        self.min_toggle = min_toggle
+        self.max_toggle = max_toggle
+        self.binshift = binshift
+        self.bg_start = bg_start
+        self.bg_stop = bg_stop
+
+    def signals(self, files: Sequence[LicelFileReader]) -> Dict[Channel, np.ndarray]:
+        """Return the signal (time x bins) of every channel in MHz, or V for analog only channels.
+
+        All files must have the same descriptor layout.
+        """
+        if not files:
+            return {}
+        key = layout_key(files[0])
+        for file in files[1:]:
+            if layout_key(file) != key:
+                raise ValueError(f"'{file.GlobalInfo.filename}' has a different dataset layout "
+                                 f"than '{files[0].GlobalInfo.filename}'")
+        result = {}
+        for channel, pair in _pairs_for_layout(key).items():
+            if pair.analog is not None and pair.pc is not None:
+                analog = np.stack([f.dataSet[pair.analog].physData for f in files])
+                pc = np.stack([f.dataSet[pair.pc].physData for f in files])
+                signal = glue_batch(analog, pc, self.binshift, self.deadtime_ns,
+                                    self.min_toggle, self.max_toggle)[0]
+            elif pair.pc is not None:
+                pc = np.stack([f.dataSet[pair.pc].physData for f in files])
+                if np.max(pc) * self.deadtime_ns * 0.001 >= 1:
+                    raise ValueError('dead time too large')
+                signal = pc / (1 - pc * self.deadtime_ns * 0.001)
+            else:
+                signal = np.stack([f.dataSet[pair.analog].physData for f in files])
+            result[channel] = signal - np.mean(signal[:, self.bg_start:self.bg_stop], axis=1, keepdims=True)
+        return result
+
+
+def ratio(signals: Dict[Channel, np.ndarray], numerator: Channel, denominator: Channel) -> np.ndarray:
+    """ return numerator / denominator for every profile and bin
+
+    Parameters
+    ----------
+    signals: Dict[Channel, np.ndarray]
+        output of :meth:`PairingEngine.signals`
+    numerator: Channel
+        channel in the numerator
+    denominator: Channel
+        channel in the denominator
+
+    Returns
+    -------
+    np.ndarray :
+        ratio (time x bins), NaN where the denominator is not positive
+    """
+    num = signals[numerator]
+    den = signals[denominator]
+    n = min(num.shape[1], den.shape[1])
+    num, den = num[:, :n], den[:, :n]
+    out = np.full(num.shape, np.nan)
+    np.divide(num, den, out=out, where=den > 0)
+    return out
+
+
+def depolarization(signals: Dict[Channel, np.ndarray], wavelength: int, calibration: float = 1.0,
+                   laserPolarization: Optional[int] = None) -> np.ndarray:
+    """ return the volume depolarization ratio, perpendicular (``s``) over parallel (``p``)
+
+    Parameters
+    ----------
+    signals: Dict[Channel, np.ndarray]
+        output of :meth:`PairingEngine.signals`
+    wavelength: int
+        wavelength in nm
+    calibration: float
+        gain ratio correction of the two channels
+    laserPolarization: int
+        select the laser polarization if the file has several
+
+    Returns
+    -------
+    np.ndarray :
+        volume depolarization ratio (time x bins)
+    """
+    perpendicular = find_channel(signals, wavelength, 's', laserPolarization)
+    parallel = find_channel(signals, wavelength, 'p', laserPolarization)
+    return calibration * ratio(signals, perpendicular, parallel)
@@ -1,9 +1,13 @@
 import numpy as np
 import re
 from dataclasses import dataclass, field
-from typing import List, IO
+from datetime import datetime
+from typing import List, IO, Tuple
 from numpy.typing import NDArray
 
+# format of StartTime and StopTime in the header
+TIME_FORMAT = '%d/%m/%Y %H:%M:%S'
+
 
 @dataclass
 class GlobalInfo:
@@ -40,6 +44,28 @@ class GlobalInfo:
             f"Shots L1: {self.numShotsL1}"
         )
 
+    def getTimes(self) -> Tuple[datetime, datetime]:
+        """StartTime and StopTime as datetime, raises ValueError if they are malformed."""
+        return datetime.strptime(self.StartTime, TIME_FORMAT), datetime.strptime(self.StopTime, TIME_FORMAT)
+
+
+@dataclass
+class Diagnostic:
+    """One finding of the integrity checks.
+
+    ``severity`` is ``'error'`` if data was lost or may be misplaced,
+    ``'warning'`` for implausible values. ``dataset`` is -1 if the finding
+    concerns the whole file, ``offset`` is the byte position or -1.
+    """
+    code: str
+    message: str
+    severity: str = 'error'
+    dataset: int = -1
+    offset: int = -1
+
+
+_SEPARATOR = b'\r\n'
+
 
 @dataclass
 class dataSet:
@@ -179,6 +205,57 @@ class dataSet:
             desc += f" {self.Polarization}"
         return desc
 
+    def phys_scale(self) -> float:
+        """Factor converting ``rawData`` into ``physData`` (V, MHz or AU)."""
+        # compute physical scaling with guards
+        shots = self.numShots if self.numShots > 0 else 1
+        scale = 1.0 / shots
+
+        if self.dataType == 0 and self.ADCBits > 0:
+            maxbits = (2 ** int(self.ADCBits)) - 1
+            if maxbits > 0:
+                scale *= (self.inputRange / maxbits)
+        elif self.dataType == 1:
+            # photon counting
+            if self.binWidth > 0:
+                scale *= (150.0 / self.binWidth)
+        elif self.dataType == 2:
+            # analog squared
+            maxbits = (2 ** int(self.ADCBits)) - 1 if self.ADCBits > 0 else 1
+            n = shots
+            sq_n_1 = np.sqrt(self.numShots - 1) if (self.numShots > 1) else 1.0
+            denom = (n * sq_n_1 * maxbits) if maxbits > 0 else (n * sq_n_1)
+            if denom != 0:
+                scale = self.inputRange / denom
+            else:
+                scale = 0.0
+        elif self.dataType == 3:
+            # photon counting squared
+            denom = np.sqrt(self.numShots - 1) if (self.numShots > 1) else 1.0
+            if self.binWidth > 0 and denom != 0:
+                scale *= (150.0 / self.binWidth) / denom
+            else:
+                scale = 0.0
+        return scale
+
+    def sanity_check(self, index: int = -1) -> List[Diagnostic]:
+        """Return warnings for implausible descriptor values."""
+        found = []
+        def warn(message):
+            found.append(Diagnostic('descriptor', f"dataset {index}: {message}", 'warning', index))
+        if not 0 <= self.dataType <= 5:
+            warn(f"unknown dataType {self.dataType}")
+        if self.numBins < 0:
+            warn(f"negative numBins {self.numBins}")
+        if self.dataType < 4:
+            if self.binWidth <= 0:
+                warn(f"binWidth {self.binWidth} m")
+            if self.numShots < 0:
+                warn(f"negative numShots {self.numShots}")
+        if self.dataType in (0, 2) and not 0 < self.ADCBits <= 32:
+            warn(f"ADCBits {self.ADCBits}")
+        return found
+
     def x_axis_m(self) -> NDArray[np.float64]:
         return np.asarray(np.arange(self.numBins, dtype=np.float64) * self.binWidth, dtype=np.float64)
 
@@ -189,20 +266,69 @@ class dataSet:
 
 
 class LicelFileReader:
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, readData: bool = True, salvage: bool = False):
+        """Read a Licel data file.
+
+        With ``readData`` False only the header and the dataset descriptors
+        are parsed, ``rawData`` and ``physData`` stay empty.
+
+        Separators, terminator and descriptor values are checked while
+        reading, the findings are collected in ``diagnostics``. A truncated
+        file or an unreadable header or descriptor raises, unless ``salvage``
+        is True: then ``dataSet`` holds only the datasets read completely,
+        none if the header itself is damaged.
+        """
         self.GlobalInfo = GlobalInfo()
         self.dataSet: List[dataSet] = []
         self.shortDescr: List[str] = []
+        self.dataOffset = 0
+        self.diagnostics: List[Diagnostic] = []
+        self.salvage = salvage
 
         encoding = 'utf-8'
         try:
             with open(filename, 'rb') as fp:
-                self._parse_header(fp, encoding)
+                try:
+                    self._parse_header(fp, encoding)
+                except (ValueError, EOFError, UnicodeDecodeError, IndexError) as e:
+                    if not salvage:
+                        raise
+                    self.diagnostics.append(Diagnostic('header', str(e) or type(e).__name__))
+                    return
                 self._read_dataset_descriptors(fp, encoding)
-                self._read_and_process_datasets(fp)
+                self.dataOffset = fp.tell()
+                if readData:
+                    self._read_and_process_datasets(fp)
+                else:
+                    for ds in self.dataSet:
+                        ds.rawData = np.zeros(0, dtype=np.uint32)
+                        ds.physData = np.zeros(0, dtype=np.float64)
+                    self.shortDescr = [ds.getShortDescr() for ds in self.dataSet]
         except Exception:
             raise
 
+    def expected_file_size(self) -> int:
+        """Size in bytes of the complete file as given by the header and descriptors."""
+        size = self.dataOffset + sum(4 * max(ds.numBins, 0) for ds in self.dataSet)
+        # CRLF between the datasets and after the last one
+        return size + 2 * len(self.dataSet)
+
+    def dataset_offsets(self) -> List[int]:
+        """Byte offset of the first bin of every dataset."""
+        offsets = []
+        pos = self.dataOffset
+        for ds in self.dataSet:
+            offsets.append(pos)
+            # data followed by the CRLF separator
+            pos += 4 * max(ds.numBins, 0) + 2
+        return offsets
+
+    @property
+    def complete(self) -> bool:
+        """True if all datasets announced in the header were read without error."""
+        return len(self.dataSet) == self.GlobalInfo.numDataSets and \
+            not any(d.severity == 'error' for d in self.diagnostics)
+
     def _parse_header(self, fp: IO[bytes], encoding: str):
         """Parse the header lines and populate GlobalInfo."""
         # header lines — decode consistently
@@ -220,8 +346,8 @@ class LicelFileReader:
             r'^(.*?)\s+'
             r'(\d{2}/\d{2}/\d{4})\s+(\d{2}:\d{2}:\d{2})\s+'
             r'(\d{2}/\d{2}/\d{4})\s+(\d{2}:\d{2}:\d{2})\s+'
-            r'(\d+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)'
-            r'(?:\s+([\d.]+))?'
+            r'(-?\d+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)'
+            r'(?:\s+(-?[\d.]+))?'
             r'\s*$',
             self.firstline.strip()
         )
@@ -245,79 +371,87 @@ class LicelFileReader:
         self.GlobalInfo.numShotsL1 = int(slsplit[2])
         self.GlobalInfo.repRateL1 = int(slsplit[3])
         self.GlobalInfo.numDataSets = int(slsplit[4])
+        if len(slsplit) >= 7:
+            # newer files append the third laser after the number of datasets
+            self.GlobalInfo.numShotsL2 = int(slsplit[5])
+            self.GlobalInfo.repRateL2 = int(slsplit[6])
 
     def _read_dataset_descriptors(self, fp: IO[bytes], encoding: str):
         """Read and parse dataset descriptor lines."""
         # read dataset descriptor lines
+        usable = True
         for i in range(self.GlobalInfo.numDataSets):
-            varline = fp.readline().decode(encoding)
+            varline = fp.readline().decode(encoding, errors='replace' if self.salvage else 'strict')
             if not varline:
-                raise EOFError("Unexpected EOF while reading dataset descriptors")
-            ds = dataSet(varline)
+                if not self.salvage:
+                    raise EOFError("Unexpected EOF while reading dataset descriptors")
+                self.diagnostics.append(Diagnostic('truncated', 'EOF in the dataset descriptors', 'error', i))
+                return
+            if not usable:
+                continue
+            try:
+                ds = dataSet(varline)
+            except ValueError as e:
+                if not self.salvage:
+                    raise
+                # the size of this dataset is unknown, so are the offsets of all following ones
+                self.diagnostics.append(Diagnostic('descriptor', str(e), 'error', i))
+                usable = False
+                continue
             if ds.dataType == 5:
                 self.GlobalInfo.overflowDs = i
+            self.diagnostics.extend(ds.sanity_check(i))
             self.dataSet.append(ds)
 
         # read blank/terminator line
-        fp.readline()
+        pos = fp.tell()
+        if fp.readline() != _SEPARATOR:
+            self.diagnostics.append(Diagnostic('separator', 'no blank line after the dataset descriptors',
+                                               'warning', -1, pos))
 
     def _read_and_process_datasets(self, fp: IO[bytes]):
         """Read binary data and compute physical data for each dataset."""
         # read binary data for each dataset — safer: read exact bytes and use frombuffer
-        for i in range(self.GlobalInfo.numDataSets):
+        for i in range(len(self.dataSet)):
             if i > 0:
-                # separator CRLF between datasets (kept as bytes)
-                fp.read(2)
+                # separator CRLF between datasets
+                pos = fp.tell()
+                sep = fp.read(2)
+                if sep != _SEPARATOR:
+                    self.diagnostics.append(Diagnostic(
+                        'separator', f"separator before dataset {i} is {sep!r}, the data may be shifted",
+                        'error', i, pos))
             numBins = self.dataSet[i].numBins
             if numBins > 0:
                 nbytes = int(numBins) * 4
+                pos = fp.tell()
                 buf = fp.read(nbytes)
                 if len(buf) != nbytes:
-                    raise EOFError(f"Unexpected EOF reading dataset {i}: expected {nbytes} bytes, got {len(buf)}")
+                    message = f"Unexpected EOF reading dataset {i}: expected {nbytes} bytes, got {len(buf)}"
+                    if not self.salvage:
+                        raise EOFError(message)
+                    self.diagnostics.append(Diagnostic('truncated', message, 'error', i, pos))
+                    del self.dataSet[i:]
+                    return
                 arr = np.frombuffer(buf, dtype=np.uint32, count=numBins).copy()
             else:
                 arr = np.zeros(0, dtype=np.uint32)
             self.dataSet[i].rawData = arr
             self.shortDescr.append(self.dataSet[i].getShortDescr())
 
-            # compute physical scaling with guards
-            shots = self.dataSet[i].numShots if self.dataSet[i].numShots > 0 else 1
-            scale = 1.0 / shots
-
-            if self.dataSet[i].dataType == 0 and self.dataSet[i].ADCBits > 0:
-                maxbits = (2 ** int(self.dataSet[i].ADCBits)) - 1
-                if maxbits > 0:
-                    scale *= (self.dataSet[i].inputRange / maxbits)
-                self.dataSet[i].physData = np.array(scale * self.dataSet[i].rawData, dtype=np.float64)
-            elif self.dataSet[i].dataType == 1:
-                # photon counting
-                if self.dataSet[i].binWidth > 0:
-                    scale *= (150.0 / self.dataSet[i].binWidth)
-                self.dataSet[i].physData = np.array(scale * self.dataSet[i].rawData, dtype=np.float64)
-            elif self.dataSet[i].dataType == 2:
-                # analog squared
-                maxbits = (2 ** int(self.dataSet[i].ADCBits)) - 1 if self.dataSet[i].ADCBits > 0 else 1
-                n = shots
-                sq_n_1 = np.sqrt(self.dataSet[i].numShots - 1) if (self.dataSet[i].numShots > 1) else 1.0
-                denom = (n * sq_n_1 * maxbits) if maxbits > 0 else (n * sq_n_1)
-                if denom != 0:
-                    scale = self.dataSet[i].inputRange / denom
-                else:
-                    scale = 0.0
-                self.dataSet[i].physData = np.array(scale * self.dataSet[i].rawData, dtype=np.float64)
-            elif self.dataSet[i].dataType == 3:
-                # photon counting squared
-                denom = np.sqrt(self.dataSet[i].numShots - 1) if (self.dataSet[i].numShots > 1) else 1.0
-                if self.dataSet[i].binWidth > 0 and denom != 0:
-                    scale *= (150.0 / self.dataSet[i].binWidth) / denom
-                else:
-                    scale = 0.0
-                self.dataSet[i].physData = np.array(scale * self.dataSet[i].rawData, dtype=np.float64)
-            else:
-                self.dataSet[i].physData = np.array(scale * self.dataSet[i].rawData, dtype=np.float64)
+            self.dataSet[i].physData = np.array(self.dataSet[i].phys_scale() * self.dataSet[i].rawData, dtype=np.float64)
+
+        if len(self.dataSet) < self.GlobalInfo.numDataSets:
+            return
+        pos = fp.tell()
+        term = fp.read(2)
+        if term != _SEPARATOR:
+            self.diagnostics.append(Diagnostic('terminator', f"file ends with {term!r} instead of CRLF",
+                                               'warning', -1, pos))
+        elif fp.read(1):
+            self.diagnostics.append(Diagnostic('trailing', 'data after the terminating CRLF', 'warning',
+                                               -1, pos + 2))
 
-        _term = fp.read(2)
-        # term is bytes, typically b'\r\n' — not fatal if different
     def get_overflow_for_dataset(self, ds_index: int) -> NDArray[np.float64]:
         """Return overflow data for the given dataset index, or zeros if not available."""
         if self.dataSet[ds_index].dataType != 0:
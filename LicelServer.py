@@ -0,0 +1,277 @@
+"""Read only HTTP access to a directory of Licel files.
+
+Only the requested dataset and bin range is read from disk: the byte offset
+of a dataset follows from the header, so the server seeks to it instead of
+decoding the whole file. Parsed headers of recently used files are kept in
+an LRU cache.
+
+Endpoints (all GET)::
+
+    /files?start=...&stop=...                  JSON list of files, times as ISO 8601
+    /meta/<file>                               JSON header and dataset descriptors
+    /data/<file>?channel=..&bins=a:b&kind=..   one profile as .npy
+    /range?start=..&stop=..&channel=..&bins=.. profiles of a time range as .npy (files x bins)
+
+``channel`` is a dataset index or a short description like ``355 nm A p``,
+``kind`` is ``phys`` (default) or ``raw``. Responses are gzip compressed if
+the client sends ``Accept-Encoding: gzip``.
+
+Run with ``python LicelServer.py D:\\Licel\\data --port 8088``.
+"""
+import argparse
+import dataclasses
+import gzip
+import io
+import json
+import os
+import threading
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from LicelReader import LicelFileReader
+
+
+def read_slice(filename: str, header: LicelFileReader, ds_index: int, start: int = 0,
+               stop: Optional[int] = None, raw: bool = False) -> np.ndarray:
+    """Read bins ``start:stop`` of one dataset by seeking to its offset."""
+    ds = header.dataSet[ds_index]
+    start, stop, _ = slice(start, stop).indices(ds.numBins)
+    count = max(stop - start, 0)
+    with open(filename, 'rb') as fp:
+        fp.seek(header.dataset_offsets()[ds_index] + 4 * start)
+        buf = fp.read(4 * count)
+    if len(buf) != 4 * count:
+        raise EOFError(f"Unexpected EOF reading dataset {ds_index} of '{filename}'")
+    data = np.frombuffer(buf, dtype='<u4', count=count).astype(np.uint32)
+    if raw:
+        return data
+    return np.array(ds.phys_scale() * data, dtype=np.float64)
+
+
+def _parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+class HeaderIndex:
+    """Headers of the files of a directory with an LRU cache of parsed headers.
+
+    Parameters
+    ----------
+    directory: str
+        data directory
+    max_headers: int
+        number of parsed headers kept
+    """
+
+    def __init__(self, directory: str, max_headers: int = 1024):
+        self.directory = directory
+        self.max_headers = max_headers
+        self._lock = threading.Lock()
+        self._headers: 'OrderedDict[str, Tuple[int, LicelFileReader]]' = OrderedDict()
+        self._times: Dict[str, Tuple[int, Optional[datetime]]] = {}
+
+    def path(self, name: str) -> str:
+        if os.path.basename(name) != name or name in ('', '.', '..'):
+            raise FileNotFoundError(name)
+        path = os.path.join(self.directory, name)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(name)
+        return path
+
+    def header(self, name: str) -> LicelFileReader:
+        path = self.path(name)
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            entry = self._headers.get(name)
+            if entry is not None and entry[0] == mtime:
+                self._headers.move_to_end(name)
+                return entry[1]
+        header = LicelFileReader(path, readData=False)
+        with self._lock:
+            self._headers[name] = (mtime, header)
+            self._headers.move_to_end(name)
+            while len(self._headers) > self.max_headers:
+                self._headers.popitem(last=False)
+        return header
+
+    def start_time(self, name: str) -> Optional[datetime]:
+        """StartTime of the file, None if it is no Licel file. Kept for every file in the directory.
+
+        Parsed without the header LRU, so listing a large archive does not
+        push the recently used headers out.
+        """
+        path = os.path.join(self.directory, name)
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._times.get(name)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            header = LicelFileReader(path, readData=False)
+            t = header.GlobalInfo.getTimes()[0]
+        except (ValueError, EOFError, UnicodeDecodeError, IndexError):
+            t = None
+        with self._lock:
+            self._times[name] = (mtime, t)
+        return t
+
+    def files(self, start: Optional[datetime] = None, stop: Optional[datetime] = None) -> List[Tuple[str, datetime]]:
+        result = []
+        names = [n for n in sorted(os.listdir(self.directory)) if os.path.isfile(os.path.join(self.directory, n))]
+        for name in names:
+            t = self.start_time(name)
+            if t is None or (start and t < start) or (stop and t >= stop):
+                continue
+            result.append((name, t))
+        # forget files that were removed from the directory
+        present = set(names)
+        with self._lock:
+            for name in [n for n in self._times if n not in present]:
+                del self._times[name]
+        return result
+
+
+def _channel_index(header: LicelFileReader, channel: str) -> int:
+    if channel.lstrip('-').isdigit():
+        index = int(channel)
+        if not 0 <= index < len(header.dataSet):
+            raise ValueError(f"no dataset {index}")
+        return index
+    if channel not in header.shortDescr:
+        raise ValueError(f"no dataset '{channel}'")
+    return header.shortDescr.index(channel)
+
+
+def _bins(value: str) -> Tuple[int, Optional[int]]:
+    if not value:
+        return 0, None
+    first, _, last = value.partition(':')
+    return int(first or 0), int(last) if last else None
+
+
+def _metadata(name: str, header: LicelFileReader) -> dict:
+    datasets = []
+    for ds, descr, offset in zip(header.dataSet, header.shortDescr, header.dataset_offsets()):
+        fields = {k: v for k, v in vars(ds).items() if k not in ('rawData', 'physData')}
+        fields.update(shortDescr=descr, offset=offset)
+        datasets.append(fields)
+    return {'file': name, 'GlobalInfo': dataclasses.asdict(header.GlobalInfo), 'dataSet': datasets}
+
+
+class LicelRequestHandler(BaseHTTPRequestHandler):
+    index: HeaderIndex = None
+
+    def _send(self, body: bytes, content_type: str):
+        headers = {'Content-Type': content_type}
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, compresslevel=5)
+            headers['Content-Encoding'] = 'gzip'
+        self.send_response(200)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_array(self, data: np.ndarray):
+        buf = io.BytesIO()
+        np.save(buf, data, allow_pickle=False)
+        self._send(buf.getvalue(), 'application/x-npy')
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+        parts = [urllib.parse.unquote(p) for p in url.path.strip('/').split('/')]
+        try:
+            raw = query.get('kind', 'phys') == 'raw'
+            start, stop = _bins(query.get('bins', ''))
+            if parts == ['files']:
+                files = self.index.files(_parse_time(query['start']) if 'start' in query else None,
+                                         _parse_time(query['stop']) if 'stop' in query else None)
+                body = [{'file': n, 'StartTime': t.isoformat()} for n, t in files]
+                self._send(json.dumps(body).encode(), 'application/json')
+            elif len(parts) == 2 and parts[0] == 'meta':
+                body = _metadata(parts[1], self.index.header(parts[1]))
+                self._send(json.dumps(body).encode(), 'application/json')
+            elif len(parts) == 2 and parts[0] == 'data':
+                header = self.index.header(parts[1])
+                ds_index = _channel_index(header, query.get('channel', '0'))
+                self._send_array(read_slice(self.index.path(parts[1]), header, ds_index, start, stop, raw))
+            elif parts == ['range']:
+                files = self.index.files(_parse_time(query['start']) if 'start' in query else None,
+                                         _parse_time(query['stop']) if 'stop' in query else None)
+                rows = []
+                for name, _ in files:
+                    header = self.index.header(name)
+                    ds_index = _channel_index(header, query.get('channel', '0'))
+                    rows.append(read_slice(self.index.path(name), header, ds_index, start, stop, raw))
+                if len({r.size for r in rows}) > 1:
+                    raise ValueError('files in the range have different bin counts')
+                dtype = np.uint32 if raw else np.float64
+                self._send_array(np.stack(rows) if rows else np.zeros((0, 0), dtype=dtype))
+            else:
+                self.send_error(404, 'unknown endpoint')
+        except FileNotFoundError as e:
+            self.send_error(404, f"no such file {e}")
+        except (ValueError, KeyError, EOFError) as e:
+            self.send_error(400, str(e))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(directory: str, host: str = '127.0.0.1', port: int = 8088,
+                max_headers: int = 1024) -> ThreadingHTTPServer:
+    """Create the server, call ``serve_forever()`` on it (port 0 picks a free port)."""
+    handler = type('Handler', (LicelRequestHandler,), {'index': HeaderIndex(directory, max_headers)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+class LicelClient:
+    """Small client for the server, ``gzip`` selects compressed transfer."""
+
+    def __init__(self, url: str, gzip: bool = True):
+        self.url = url.rstrip('/')
+        self.gzip = gzip
+
+    def _get(self, path: str, **query) -> bytes:
+        query = {k: v for k, v in query.items() if v is not None}
+        url = f"{self.url}/{path}" + (('?' + urllib.parse.urlencode(query)) if query else '')
+        request = urllib.request.Request(url, headers={'Accept-Encoding': 'gzip'} if self.gzip else {})
+        with urllib.request.urlopen(request) as response:
+            body = response.read()
+            if response.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+        return body
+
+    def files(self, start: Optional[str] = None, stop: Optional[str] = None) -> list:
+        return json.loads(self._get('files', start=start, stop=stop))
+
+    def meta(self, name: str) -> dict:
+        return json.loads(self._get('meta/' + urllib.parse.quote(name)))
+
+    def data(self, name: str, channel='0', bins: str = '', kind: str = 'phys') -> np.ndarray:
+        body = self._get('data/' + urllib.parse.quote(name), channel=channel, bins=bins, kind=kind)
+        return np.load(io.BytesIO(body), allow_pickle=False)
+
+    def range(self, start: Optional[str] = None, stop: Optional[str] = None, channel='0',
+              bins: str = '', kind: str = 'phys') -> np.ndarray:
+        body = self._get('range', start=start, stop=stop, channel=channel, bins=bins, kind=kind)
+        return np.load(io.BytesIO(body), allow_pickle=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='read only HTTP server for Licel data files')
+    parser.add_argument('directory')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8088)
+    args = parser.parse_args()
+    server = make_server(args.directory, args.host, args.port)
+    print(f"serving {args.directory} on http://{args.host}:{server.server_address[1]}")
+    server.serve_forever()
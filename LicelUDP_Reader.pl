@@ -1,81 +1,59 @@
+
 import socket
-import configparser
 import os
-import matplotlib
-import matplotlib.pyplot as plt
+import threading
+
+try:
+    import numba
+    if 'NUMBA_THREADING_LAYER' not in os.environ:
+        # the layer detection runs numba kernels in the receiver thread, TBB may then hang at exit
+        numba.config.THREADING_LAYER_PRIORITY = ['omp', 'tbb', 'workqueue']
+except ImportError:
+    pass
 from LicelReader import *
 from LicelUtil import *
+from LicelMonitor import LiveMonitor, MonitorConfig
+from LicelWatch import DirectoryWatcher
 
 
 
-config = configparser.ConfigParser()
-config.read('LicelUDP.ini')
-data_path = config['Reader']['dataDir']
-
-numDataSets = int(config['Reader']['numDataSets'])
-ds = []
-line = []
-for i in range(numDataSets):
-  ds.append(int(config['Reader']['ds' + str(i)]))
-
-
-logPlot = bool(config['Reader']['logPlot'])
-
+config = MonitorConfig.from_ini('LicelUDP.ini')
+data_path = config.dataDir
+monitor = LiveMonitor(config)
 
-client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) # UDP
 
-# Enable broadcasting mode
-client.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-
-client.bind(("", 2088))
-isInitialized = False
-plt.ion()
-fig, ax = plt.subplots()
-
-
-while True:
-    # Thanks @seym45 for a fix
-    data, addr = client.recvfrom(1024)
-
-    filename = str(data).split('\\')[-1]
-    if filename.find('START') > 0 or filename.find('STOP') > 0 :
-        continue
-    filename = filename.split('\'')[0]
-    filepath = os.path.join(data_path, filename)
-    file = LicelFileReader(filepath)
+def show(filepath):
     print(filepath)
-    
-    ax.set_title(filename)
-    ax.set_xlabel('m')
-    if file.dataSet[0].dataType == 0 :
-        ax.set_ylabel('mV')
-    elif file.dataSet[0].dataType == 1 :
-        axes.set_ylabel('MHz')
-    else :             
-        axes.set_ylabel('AU')
-    if not isInitialized :
-        isInitialized = True
-        for i in range(numDataSets) :
-            x = file.dataSet[ds[i]].x_axis_m()
-            y = file.dataSet[ds[i]].physData
+    # only decodes, drawing happens at the configured frame rate below
+    try:
+        monitor.update(filepath)
+    except (OSError, ValueError, EOFError, IndexError, UnicodeDecodeError) as e:
+        # runs in the receiver or watcher thread, one bad file must not end it
+        print(f"skipping {filepath}: {e}")
+
 
-            if( logPlot) :
-                (ll, )  = ax.semilogy(x,y)
-                line.append(ll)
-            else :
-                (ll, ) = ax.plot(x,y)
-                line.append(ll)
-        
-        fig.canvas.draw()
-        fig.canvas.flush_events()
+def receive():
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) # UDP
 
-    else :
-        for i in range(numDataSets) :
-            line[i].set_ydata(file.dataSet[ds[i]].physData)
+    # Enable broadcasting mode
+    client.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
 
-        fig.canvas.draw()
-        fig.canvas.flush_events()
+    client.bind(("", 2088))
 
+    while True:
+        # Thanks @seym45 for a fix
+        data, addr = client.recvfrom(1024)
 
+        filename = str(data).split('\\')[-1]
+        if filename.find('START') > 0 or filename.find('STOP') > 0 :
+            continue
+        filename = filename.split('\'')[0]
+        show(os.path.join(data_path, filename))
 
 
+if config.ingest == 'watch':
+    # no UDP notifications needed, new files are picked up from dataDir
+    DirectoryWatcher(data_path, show).start()
+else:
+    threading.Thread(target=receive, daemon=True).start()
+monitor.run()
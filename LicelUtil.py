@@ -317,7 +317,7 @@ def glue_profiles(analog: np.ndarray, pc_MHz: np.ndarray, binshift : int,
       pc_corr =  deadtime_correction(pc_shifted, deadtime_ns)
       [analog_sk, pc_sk] = skip_first_bins(analog_shifted, pc_corr, skip_bins)
       if check_gluing_strategy (analog_sk, pc_sk, min_toggle, max_toggle) == GluingStrategy.GLUE_PROFILES :
-         [analog_compressed, pc_compressed] = mask_profiles(analog_sk, pc_corr, min_toggle, max_toggle)
+         [analog_compressed, pc_compressed] = mask_profiles(analog_sk, pc_sk, min_toggle, max_toggle)
          [m,b] = analog_to_pc_scale(analog_compressed, pc_compressed, 0, pc_compressed.size)
          fit_error = np.mean(np.square(m * analog_compressed + b - pc_compressed))
          analog_scaled =  m * analog_shifted + b
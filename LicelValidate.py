@@ -0,0 +1,149 @@
+"""Integrity checks for directories of Licel files.
+
+:func:`check_file` only parses the header and descriptors. It compares the
+file size with the size the descriptors announce and reads the two byte
+separators at the computed offsets, the data itself is never decoded. That
+is fast enough to check thousands of files per second, :func:`fsck` runs it
+over a directory with a process pool.
+
+To get the data out of a damaged file use
+``LicelFileReader(filename, salvage=True)``, it keeps every complete dataset
+and lists the problems in ``diagnostics``.
+
+Run with ``python LicelValidate.py D:\\Licel\\data --workers 8``.
+"""
+import argparse
+import dataclasses
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterator, List, Sequence
+
+from LicelReader import _SEPARATOR, Diagnostic, LicelFileReader
+
+
+@dataclass
+class FileReport:
+    """Result of :func:`check_file`.
+
+    ``completeDataSets`` counts the datasets that lie completely inside the
+    file, they can be read with ``LicelFileReader(filename, salvage=True)``.
+    """
+    filename: str
+    size: int = 0
+    expectedSize: int = 0
+    numDataSets: int = 0
+    completeDataSets: int = 0
+    diagnostics: List[Diagnostic] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not any(d.severity == 'error' for d in self.diagnostics)
+
+
+def check_file(filename: str) -> FileReport:
+    """Check one file with size and offset arithmetic, without reading the data."""
+    report = FileReport(filename)
+    try:
+        report.size = os.stat(filename).st_size
+        header = LicelFileReader(filename, readData=False, salvage=True)
+    except OSError as e:
+        report.diagnostics.append(Diagnostic('header', str(e) or type(e).__name__))
+        return report
+    report.diagnostics.extend(header.diagnostics)
+    if any(d.code == 'header' for d in header.diagnostics):
+        return report
+    report.numDataSets = header.GlobalInfo.numDataSets
+    report.expectedSize = header.expected_file_size()
+
+    offsets = header.dataset_offsets()
+    ends = [offset + 4 * max(ds.numBins, 0) for offset, ds in zip(offsets, header.dataSet)]
+    report.completeDataSets = sum(1 for end in ends if end <= report.size)
+    if len(header.dataSet) < header.GlobalInfo.numDataSets:
+        # a descriptor could not be parsed, the size of the rest is unknown
+        return report
+    if ends and ends[-1] <= report.size < report.expectedSize:
+        # all data is there, only the terminating CRLF is missing or cut
+        report.diagnostics.append(Diagnostic(
+            'terminator', 'the terminating CRLF is missing', 'warning', -1, ends[-1]))
+    elif report.size < report.expectedSize:
+        report.diagnostics.append(Diagnostic(
+            'truncated', f"{report.size} bytes instead of {report.expectedSize}, "
+                         f"{report.numDataSets - report.completeDataSets} datasets incomplete",
+            'error', report.completeDataSets, report.size))
+    elif report.size > report.expectedSize:
+        report.diagnostics.append(Diagnostic(
+            'trailing', f"{report.size - report.expectedSize} bytes after the last dataset",
+            'warning', -1, report.expectedSize))
+
+    # the CRLF after every dataset must sit exactly where the descriptors put it
+    with open(filename, 'rb') as fp:
+        for i, end in enumerate(ends):
+            if end + 2 > report.size:
+                break
+            fp.seek(end)
+            sep = fp.read(2)
+            if sep != _SEPARATOR:
+                last = i == len(ends) - 1
+                report.diagnostics.append(Diagnostic(
+                    'terminator' if last else 'separator',
+                    f"{sep!r} instead of CRLF after dataset {i}" + ('' if last else ', the data may be shifted'),
+                    'warning' if last else 'error', i if last else i + 1, end))
+    return report
+
+
+def _check_files(filenames: Sequence[str]) -> List[FileReport]:
+    return [check_file(f) for f in filenames]
+
+
+def fsck(filenames: Sequence[str], workers: int = 1, chunk_files: int = 256) -> Iterator[FileReport]:
+    """ check many files, reports are yielded in the order of ``filenames``
+
+    Parameters
+    ----------
+    filenames: Sequence[str]
+        files to check
+    workers: int
+        number of processes, 1 checks in this process
+    chunk_files: int
+        files handed to a worker at once
+
+    Returns
+    -------
+    Iterator[FileReport] :
+        one report per file
+    """
+    chunks = [filenames[i:i + chunk_files] for i in range(0, len(filenames), chunk_files)]
+    if workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield from _check_files(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for reports in pool.map(_check_files, chunks):
+            yield from reports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='check the integrity of Licel data files')
+    parser.add_argument('directory')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--warnings', action='store_true', help='also list files with warnings only')
+    parser.add_argument('--json', action='store_true', help='one JSON report per line')
+    args = parser.parse_args()
+    names = sorted(os.path.join(args.directory, n) for n in os.listdir(args.directory))
+    names = [n for n in names if os.path.isfile(n)]
+    bad = 0
+    for report in fsck(names, args.workers):
+        bad += not report.ok
+        if report.ok and not (args.warnings and report.diagnostics):
+            continue
+        if args.json:
+            print(json.dumps(dataclasses.asdict(report)))
+            continue
+        print(f"{report.filename}: {report.completeDataSets}/{report.numDataSets} datasets complete")
+        for d in report.diagnostics:
+            print(f"    {d.severity} {d.code}: {d.message}")
+    print(f"{len(names)} files checked, {bad} damaged", file=sys.stderr)
+    sys.exit(1 if bad else 0)
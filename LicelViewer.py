@@ -10,6 +10,7 @@ import matplotlib
 import matplotlib.pyplot as plt
 from LicelReader import *
 from LicelUtil import *
+from LicelDetect import detect_background
 
 matplotlib.use('TkAgg')
 
@@ -83,8 +84,7 @@ class App(tk.Tk):
         if self.file.dataSet[ds].dataType == 0 :
             y = 1000 * self.file.dataSet[ds].physData
         if self.file.dataSet[ds].dataType == 0 or self.file.dataSet[ds].dataType == 1 :
-            base_start = -1000
-            base_end = -1
+            base_start, base_end = detect_background(y, 1000)
         else:
             base_start = 0
             base_end = 100
@@ -0,0 +1,209 @@
+"""Watch the data directory for new Licel files instead of relying on UDP notifications.
+
+On Linux the directory is watched with inotify (through ``ctypes``, no extra
+package needed), elsewhere or if inotify is not available the directory is
+polled. A file is reported once its size reaches the size announced by its
+header and dataset descriptors, files that are still being written are held
+back until they are complete.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from LicelReader import LicelFileReader
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct('iIII')
+
+
+def is_complete(path: str, tolerance: int = 0) -> bool:
+    """Return True if the file is at least as long as its header announces.
+
+    ``tolerance`` bytes may be missing, 2 accepts files without the final CRLF.
+    """
+    try:
+        size = os.path.getsize(path)
+        header = LicelFileReader(path, readData=False)
+    except (OSError, ValueError, EOFError, UnicodeDecodeError, IndexError):
+        return False
+    return size >= header.expected_file_size() - tolerance
+
+
+class _Inotify:
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for '{directory}'")
+
+    def read(self, timeout: float) -> Dict[str, int]:
+        """Wait up to ``timeout`` seconds and return the event masks per file name."""
+        events: Dict[str, int] = {}
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return events
+        try:
+            buf = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return events
+        pos = 0
+        while pos + _EVENT.size <= len(buf):
+            _, mask, _, length = _EVENT.unpack_from(buf, pos)
+            pos += _EVENT.size
+            name = buf[pos:pos + length].rstrip(b'\0').decode(errors='replace')
+            pos += length
+            if name:
+                events[name] = events.get(name, 0) | mask
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirectoryWatcher:
+    """Report newly completed Licel files in ``directory``.
+
+    Parameters
+    ----------
+    directory: str
+        directory to watch, e.g. ``dataDir`` of ``LicelUDP.ini``
+    callback: Callable[[str], None]
+        called with the full path of every completed file, in the watcher thread
+    debounce: float
+        seconds a file must be unchanged before it is checked, files closed
+        by the writer are checked immediately
+    poll_interval: float
+        seconds between directory scans when polling
+    stale: float
+        files unchanged for this long are reported if only the final CRLF is
+        missing and dropped otherwise
+    use_inotify: bool
+        set False to force polling
+    """
+
+    def __init__(self, directory: str, callback: Callable[[str], None], debounce: float = 0.5,
+                 poll_interval: float = 1.0, stale: float = 30.0, use_inotify: bool = True):
+        self.directory = directory
+        self.callback = callback
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.stale = stale
+        self._stop = threading.Event()
+        self._pending: Dict[str, float] = {}
+        self._reported: Dict[str, Tuple[int, int]] = {}
+        self._known: Dict[str, Tuple[int, int]] = {}
+        self._inotify: Optional[_Inotify] = None
+        if use_inotify:
+            try:
+                self._inotify = _Inotify(directory)
+            except (OSError, AttributeError, TypeError):
+                # no inotify on this platform or file system, fall back to polling
+                self._inotify = None
+        # files already in the directory are not reported
+        for name, sig in self._scan().items():
+            self._known[name] = sig
+            self._reported[name] = sig
+
+    @property
+    def polling(self) -> bool:
+        return self._inotify is None
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        result = {}
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file():
+                    st = entry.stat()
+                    result[entry.name] = (st.st_size, st.st_mtime_ns)
+        return result
+
+    def _signature(self, name: str) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(os.path.join(self.directory, name))
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime_ns)
+
+    def _try_report(self, name: str, now: float, closed: bool = False) -> bool:
+        """Report the file if complete, return True if it no longer needs watching."""
+        sig = self._signature(name)
+        if sig is None:
+            return True
+        if self._reported.get(name) == sig:
+            return True
+        path = os.path.join(self.directory, name)
+        last = self._pending.get(name, now)
+        if not closed and now - last < self.debounce:
+            return False
+        stale = now - last >= self.stale
+        if is_complete(path) or (stale and is_complete(path, tolerance=2)):
+            self._reported[name] = sig
+            self.callback(path)
+            return True
+        return stale
+
+    def _process_pending(self, now: float):
+        for name in sorted(self._pending):
+            if self._try_report(name, now):
+                del self._pending[name]
+
+    def poll_once(self, timeout: float = 0.0):
+        """Handle the events of one watch interval."""
+        now = time.monotonic()
+        if self._inotify is not None:
+            for name, mask in self._inotify.read(timeout).items():
+                now = time.monotonic()
+                if mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and self._try_report(name, now, closed=True):
+                    self._pending.pop(name, None)
+                else:
+                    self._pending[name] = now
+        else:
+            if timeout > 0:
+                self._stop.wait(timeout)
+            now = time.monotonic()
+            current = self._scan()
+            for name in set(self._known) - set(current):
+                del self._known[name]
+                self._reported.pop(name, None)
+            for name, sig in current.items():
+                if self._known.get(name) != sig:
+                    self._known[name] = sig
+                    self._pending[name] = now
+        self._process_pending(time.monotonic())
+
+    def run(self):
+        """Watch until :meth:`stop` is called, blocks the calling thread."""
+        try:
+            while not self._stop.is_set():
+                if self.polling:
+                    timeout = min(self.poll_interval, self.debounce) if self._pending else self.poll_interval
+                else:
+                    # block in select while idle, wake up only to finish debouncing
+                    timeout = self.debounce if self._pending else 1.0
+                self.poll_once(timeout)
+        finally:
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
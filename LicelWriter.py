@@ -0,0 +1,265 @@
+"""Write Licel data files and merge short files into longer ones.
+
+:class:`LicelFileWriter` writes a :class:`LicelReader.GlobalInfo` and a list
+of :class:`LicelReader.dataSet` descriptors followed by the uint32 data
+blocks, one dataset after the other, so the output reads back unchanged
+with :class:`LicelReader.LicelFileReader`. The file is written under a
+temporary name and renamed when complete, a watched data directory never
+sees a partial file.
+
+:func:`merge_files` sums ``rawData`` and ``numShots`` of N files with the
+same dataset layout and optionally sums groups of ``2**exponent`` range
+bins of photon counting datasets (as :func:`LicelUtil.downsampling`). Only
+the accumulators of one output file and the file currently read are held in
+memory. The analog overflow dataset is combined with a bitwise or,
+powermeter datasets are concatenated.
+
+Run with ``python LicelWriter.py D:\\Licel\\data --files 10 --exponent 1 --out merged``.
+"""
+import argparse
+import os
+from typing import IO, List, Optional, Sequence
+
+import numpy as np
+
+from LicelReader import _SEPARATOR, TIME_FORMAT, GlobalInfo, LicelFileReader, dataSet
+
+
+def _number(value: float, decimals: int) -> str:
+    """Fixed point as Licel writes it, more digits if that would change the value."""
+    text = f"{value:.{decimals}f}"
+    if float(text) != value:
+        text = np.format_float_positional(value, trim='-')
+    return text
+
+
+def header_lines(info: GlobalInfo, numDataSets: int) -> List[str]:
+    """The three header lines of a file, without line ends."""
+    if not info.filename or not info.Location:
+        raise ValueError('filename and Location must not be empty')
+    position = ' '.join(_number(v, 1) for v in (info.Longitude, info.Latitude, info.Zenith, info.Azimuth))
+    lines = [
+        f" {info.filename}",
+        f" {info.Location} {info.StartTime} {info.StopTime} {int(info.Height):04d} {position}",
+        f" {info.numShotsL0:07d} {info.repRateL0:04d} {info.numShotsL1:07d} {info.repRateL1:04d} {numDataSets:02d}",
+    ]
+    if info.numShotsL2 or info.repRateL2:
+        lines[2] += f" {info.numShotsL2:07d} {info.repRateL2:04d}"
+    return lines
+
+
+def descriptor_line(ds: dataSet) -> str:
+    """The descriptor line of a dataset, e.g. `` 1 0 1 04000 1 0850 7.50 00355.p 0 0 00 000 12 001200 0.500 BT0``."""
+    if not ds.descriptor or len(ds.descriptor.split()) != 1:
+        raise ValueError(f"invalid dataset descriptor '{ds.descriptor}'")
+    if (ds.dataType == 0) or (ds.dataType == 2):
+        level = _number(ds.inputRange, 3)
+    else:
+        # photon counting discriminator with 4 decimals, the overflow and powermeter datasets use 3
+        level = _number(ds.discriminator, 4 if ds.dataType in (1, 3) else 3)
+    line = (f" {ds.active} {ds.dataType} {ds.laserSource} {ds.numBins:05d} {ds.laserPolarization}"
+            f" {ds.highVoltage:04d} {_number(ds.binWidth, 2)} {ds.wavelength:05d}.{ds.Polarization}"
+            f" {ds.binshift} {ds.binshiftPart} 00 000 {ds.ADCBits:02d} {ds.numShots:06d} {level} {ds.descriptor}")
+    if ds.comment:
+        line += ' ' + ' '.join(ds.comment.split())
+    return line
+
+
+def new_dataset(**fields) -> dataSet:
+    """Create a dataset descriptor, e.g. ``new_dataset(dataType=1, numBins=4000, wavelength=355)``.
+
+    Fields not given keep the defaults of :class:`LicelReader.dataSet`, the
+    descriptor defaults to ``BT0`` for analog and ``BC0`` for other types.
+    """
+    ds = dataSet(' 1 0 1 00000 0 0000 7.50 00000.o 0 0 00 000 00 000000 0.500 BT0')
+    ds.descriptor = ''
+    ds.rawData = np.zeros(0, dtype=np.uint32)
+    ds.physData = np.zeros(0, dtype=np.float64)
+    for name, value in fields.items():
+        if not hasattr(ds, name):
+            raise TypeError(f"dataSet has no field '{name}'")
+        setattr(ds, name, value)
+    if not ds.descriptor:
+        ds.descriptor = 'BT0' if ds.dataType in (0, 2) else 'BC0'
+    return ds
+
+
+class LicelFileWriter:
+    """Write one Licel file, dataset by dataset.
+
+    Parameters
+    ----------
+    filename: str
+        target file, written as ``filename + '.tmp'`` and renamed by :meth:`close`
+    info: GlobalInfo
+        header, ``filename`` defaults to the base name of the target
+    dataSets: Sequence[dataSet]
+        descriptors, ``numBins`` fixes the length of every data block
+
+    Use as a context manager and call :meth:`write_data` once per dataset,
+    or write complete datasets with :meth:`write`.
+    """
+
+    def __init__(self, filename: str, info: GlobalInfo, dataSets: Sequence[dataSet]):
+        self.filename = filename
+        self.dataSets = list(dataSets)
+        self._next = 0
+        self._tmp = filename + '.tmp'
+        if not info.filename:
+            info = GlobalInfo(**{**vars(info), 'filename': os.path.basename(filename)})
+        lines = header_lines(info, len(self.dataSets)) + [descriptor_line(ds) for ds in self.dataSets]
+        self._fp: Optional[IO[bytes]] = open(self._tmp, 'wb')
+        self._fp.write(('\r\n'.join(lines) + '\r\n').encode('utf-8') + _SEPARATOR)
+
+    def write_data(self, rawData: np.ndarray):
+        """Write the data block of the next dataset."""
+        if self._next >= len(self.dataSets):
+            raise ValueError(f"all {len(self.dataSets)} datasets are written already")
+        ds = self.dataSets[self._next]
+        rawData = np.asarray(rawData)
+        if rawData.shape != (ds.numBins,):
+            raise ValueError(f"dataset {self._next} needs {ds.numBins} bins, got shape {rawData.shape}")
+        if rawData.size and (rawData.min() < 0 or rawData.max() > 0xFFFFFFFF):
+            raise ValueError(f"dataset {self._next} does not fit into uint32")
+        if self._next > 0:
+            self._fp.write(_SEPARATOR)
+        self._fp.write(rawData.astype('<u4').tobytes())
+        self._next += 1
+
+    def close(self):
+        """Finish the file, an incomplete file is removed and raises."""
+        if self._fp is None:
+            return
+        fp, self._fp = self._fp, None
+        complete = self._next == len(self.dataSets)
+        if complete:
+            fp.write(_SEPARATOR)
+        fp.close()
+        if not complete:
+            os.remove(self._tmp)
+            raise ValueError(f"only {self._next} of {len(self.dataSets)} datasets written")
+        os.replace(self._tmp, self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._fp is not None:
+            self._fp.close()
+            self._fp = None
+            os.remove(self._tmp)
+
+    @classmethod
+    def write(cls, filename: str, info: GlobalInfo, dataSets: Sequence[dataSet]):
+        """Write a file from datasets that carry their ``rawData``."""
+        with cls(filename, info, dataSets) as writer:
+            for ds in dataSets:
+                writer.write_data(ds.rawData)
+
+
+def _layout(file: LicelFileReader) -> list:
+    return [(ds.dataType, ds.numBins if ds.dataType != 4 else None, ds.binWidth, ds.wavelength,
+             ds.Polarization, ds.laserSource, ds.highVoltage, ds.ADCBits, ds.inputRange, ds.discriminator, ds.descriptor)
+            for ds in file.dataSet]
+
+
+def _rebin(data: np.ndarray, dataType: int, factor: int) -> np.ndarray:
+    pieces = data.size // factor
+    blocks = data[:pieces * factor].reshape(pieces, factor)
+    if dataType == 5:
+        return np.bitwise_or.reduce(blocks, axis=1)
+    return blocks.sum(axis=1)
+
+
+def merge_files(filenames: Sequence[str], target: str, exponent: int = 0) -> GlobalInfo:
+    """ sum files with the same dataset layout into one file
+
+    Parameters
+    ----------
+    filenames: Sequence[str]
+        input files, read one after the other
+    target: str
+        output file
+    exponent: int
+        sum groups of ``2**exponent`` range bins, ``binWidth`` grows accordingly.
+        Only for photon counting: the count rate stays right with the wider
+        bins, but the descriptor cannot express summed analog bins or sums of
+        squares, files with such datasets raise ValueError
+
+    Returns
+    -------
+    GlobalInfo :
+        header of the written file
+    """
+    if not filenames:
+        raise ValueError('no files to merge')
+    factor = 1 << exponent
+    first = None
+    sums: List[np.ndarray] = []
+    shots: List[int] = []
+    start = stop = None
+    for filename in filenames:
+        file = LicelFileReader(filename)
+        begin, end = file.GlobalInfo.getTimes()
+        if first is None:
+            first = file
+            info = GlobalInfo(**vars(file.GlobalInfo))
+            info.numShotsL0 = info.numShotsL1 = info.numShotsL2 = 0
+            start, stop = begin, end
+            sums = [np.zeros(0 if ds.dataType == 4 else ds.numBins // factor, dtype=np.uint64)
+                    for ds in file.dataSet]
+            shots = [0] * len(file.dataSet)
+            if exponent > 0 and any(ds.dataType in (0, 2, 3) for ds in file.dataSet):
+                raise ValueError(f"'{filename}' has analog or squared datasets, their range bins "
+                                 f"cannot be combined, merge with exponent 0")
+        elif _layout(file) != _layout(first):
+            raise ValueError(f"'{filename}' has a different dataset layout than '{filenames[0]}'")
+        start, stop = min(start, begin), max(stop, end)
+        info.numShotsL0 += file.GlobalInfo.numShotsL0
+        info.numShotsL1 += file.GlobalInfo.numShotsL1
+        info.numShotsL2 += file.GlobalInfo.numShotsL2
+        for i, ds in enumerate(file.dataSet):
+            shots[i] += ds.numShots
+            if ds.dataType == 4:
+                # one value per laser shot
+                sums[i] = np.concatenate([sums[i], ds.rawData.astype(np.uint64)])
+            elif ds.dataType == 5:
+                np.bitwise_or(sums[i], _rebin(ds.rawData.astype(np.uint64), 5, factor), out=sums[i])
+            else:
+                sums[i] += _rebin(ds.rawData.astype(np.uint64), ds.dataType, factor)
+
+    info.filename = os.path.basename(target)
+    info.StartTime = start.strftime(TIME_FORMAT)
+    info.StopTime = stop.strftime(TIME_FORMAT)
+    dataSets = []
+    for ds, data, numShots in zip(first.dataSet, sums, shots):
+        if data.size and data.max() > 0xFFFFFFFF:
+            raise ValueError(f"sum of dataset '{ds.getShortDescr()}' exceeds uint32, merge fewer files")
+        merged = new_dataset(**{k: v for k, v in vars(ds).items() if k not in ('rawData', 'physData')})
+        merged.numBins = data.size
+        merged.numShots = numShots
+        if ds.dataType == 1:
+            merged.binWidth = ds.binWidth * factor
+        merged.rawData = data.astype(np.uint32)
+        dataSets.append(merged)
+    LicelFileWriter.write(target, info, dataSets)
+    return info
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='merge Licel data files')
+    parser.add_argument('directory')
+    parser.add_argument('--files', type=int, default=10, help='input files per output file')
+    parser.add_argument('--exponent', type=int, default=0,
+                        help='sum 2**exponent range bins, photon counting files only')
+    parser.add_argument('--out', default='merged')
+    args = parser.parse_args()
+    names = sorted(os.path.join(args.directory, n) for n in os.listdir(args.directory))
+    names = [n for n in names if os.path.isfile(n)]
+    os.makedirs(args.out, exist_ok=True)
+    for i in range(0, len(names), args.files):
+        group = names[i:i + args.files]
+        merge_files(group, os.path.join(args.out, os.path.basename(group[0])), args.exponent)
+    print(f"{len(names)} files merged into {(len(names) + args.files - 1) // args.files} in {args.out}")
@@ -0,0 +1,228 @@
+"""xarray view of Licel files and streaming export to CF NetCDF.
+
+:func:`open_dataset` only reads the headers up front and returns an
+``xarray.Dataset`` with the dimensions time x channel x range, the data
+itself is read lazily in dask chunks of ``chunk_files`` files. Every kind
+of signal gets its own variable with CF ``units`` (``analog`` in V,
+``photon_counting`` in MHz) and channel dimension (``analog_channel``,
+...). The metadata of all channels from :class:`LicelReader.dataSet` are
+coordinates along ``channel``, the site position from
+:class:`LicelReader.GlobalInfo` becomes scalar ``latitude``, ``longitude``
+and ``altitude`` coordinates. :func:`to_netcdf` writes such a dataset chunk
+by chunk, so a whole campaign never has to fit into memory.
+
+Needs ``xarray``, ``dask`` for the lazy loading (without it the data is
+read at once) and ``netCDF4`` or ``h5netcdf`` for writing.
+"""
+import os
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from LicelReader import LicelFileReader
+
+try:
+    import xarray as xr
+    from xarray.backends import BackendEntrypoint
+except ImportError:
+    xr = None
+    BackendEntrypoint = object
+
+try:
+    import dask
+    import dask.array as da
+except ImportError:
+    dask = None
+
+_CHANNEL_FIELDS = ['wavelength', 'Polarization', 'dataType', 'laserSource', 'laserPolarization',
+                   'highVoltage', 'binWidth', 'ADCBits', 'inputRange', 'discriminator', 'descriptor']
+_CHANNEL_ATTRS = {'wavelength': {'units': 'nm'}, 'binWidth': {'units': 'm'}, 'highVoltage': {'units': 'V'},
+                  'inputRange': {'units': 'V'}, 'discriminator': {'units': 'mV'}}
+# variable name, long name and units of the physData of each data type
+_SIGNALS = {0: ('analog', 'analog signal', 'V'),
+            1: ('photon_counting', 'photon counting rate', 'MHz'),
+            2: ('analog_squared', 'sum of squares of the analog signal', '1'),
+            3: ('photon_counting_squared', 'sum of squares of the photon counting rate', '1')}
+
+
+def _require_xarray():
+    if xr is None:
+        raise ImportError('LicelXarray needs xarray, install it with pip install xarray dask netCDF4')
+
+
+def list_files(path: str) -> List[str]:
+    """Return the Licel files of a directory sorted by name, or the file itself."""
+    if not os.path.isdir(path):
+        return [path]
+    names = sorted(os.path.join(path, n) for n in os.listdir(path))
+    return [n for n in names if os.path.isfile(n)]
+
+
+def _times(header: LicelFileReader) -> Tuple[np.datetime64, np.datetime64]:
+    start, stop = header.GlobalInfo.getTimes()
+    return np.datetime64(start, 'ns'), np.datetime64(stop, 'ns')
+
+
+def _load_block(files: Sequence[str], indices: Sequence[int], numBins: int, raw: bool) -> np.ndarray:
+    dtype = np.uint32 if raw else np.float64
+    out = np.zeros((len(files), len(indices), numBins), dtype=dtype)
+    if not raw:
+        out[:] = np.nan
+    for i, filename in enumerate(files):
+        file = LicelFileReader(filename)
+        for j, k in enumerate(indices):
+            data = file.dataSet[k].rawData if raw else file.dataSet[k].physData
+            out[i, j, :data.size] = data
+    return out
+
+
+def open_dataset(path, channels: Optional[Sequence[str]] = None, chunk_files: int = 32,
+                 include_raw: bool = False) -> 'xr.Dataset':
+    """Open one Licel file, a directory or a list of files as ``xarray.Dataset``.
+
+    Parameters
+    ----------
+    path: str or Sequence[str]
+        data file, directory of data files or list of files
+    channels: Sequence[str]
+        short descriptions (``getShortDescr()``) of the datasets to include,
+        default all analog and photon counting datasets
+    chunk_files: int
+        number of files per dask chunk along time
+    include_raw: bool
+        add the raw counts as variable ``rawData`` next to ``physData``
+
+    Returns
+    -------
+    xr.Dataset :
+        ``analog`` (time, analog_channel, range) in V, ``photon_counting``
+        (time, photon_counting_channel, range) in MHz and so on for the
+        squared data types, shorter datasets are padded with NaN. With
+        ``include_raw`` the counts are in ``analog_raw`` etc.
+    """
+    _require_xarray()
+    files = list_files(path) if isinstance(path, str) else list(path)
+    headers = []
+    for filename in files:
+        try:
+            headers.append((filename, LicelFileReader(filename, readData=False)))
+        except (ValueError, EOFError, UnicodeDecodeError, IndexError):
+            # not a Licel file
+            continue
+    if not headers:
+        raise ValueError(f"No Licel files found in '{path}'")
+    headers.sort(key=lambda h: (_times(h[1])[0], h[0]))
+    files = [f for f, _ in headers]
+    first = headers[0][1]
+
+    if channels is None:
+        indices = [i for i, ds in enumerate(first.dataSet) if ds.dataType < 4]
+    else:
+        indices = [first.shortDescr.index(c) for c in channels]
+    layout = [(first.shortDescr[i], first.dataSet[i].numBins) for i in indices]
+    for filename, header in headers[1:]:
+        if [(header.shortDescr[i], header.dataSet[i].numBins) for i in indices if i < len(header.dataSet)] != layout:
+            raise ValueError(f"'{filename}' has a different dataset layout than '{files[0]}'")
+    selected = [first.dataSet[i] for i in indices]
+    if len({ds.binWidth for ds in selected}) > 1:
+        raise ValueError('selected channels have different bin widths, open them separately')
+    numBins = max(ds.numBins for ds in selected)
+    longest = selected[[ds.numBins for ds in selected].index(numBins)]
+
+    def variable(group: List[int], raw: bool):
+        dtype = np.uint32 if raw else np.float64
+        if dask is None:
+            return _load_block(files, group, numBins, raw)
+        blocks = []
+        for start in range(0, len(files), chunk_files):
+            part = files[start:start + chunk_files]
+            delayed = dask.delayed(_load_block)(part, group, numBins, raw)
+            blocks.append(da.from_delayed(delayed, (len(part), len(group), numBins), dtype=dtype))
+        return da.concatenate(blocks, axis=0)
+
+    data_vars = {}
+    coords = {}
+    for dataType, (name, long_name, units) in _SIGNALS.items():
+        group = [i for i in indices if first.dataSet[i].dataType == dataType]
+        if not group:
+            continue
+        dims = ('time', name + '_channel', 'range')
+        coords[dims[1]] = (dims[1], [first.shortDescr[i] for i in group])
+        data_vars[name] = (dims, variable(group, False), {'long_name': long_name, 'units': units})
+        if include_raw:
+            data_vars[name + '_raw'] = (dims, variable(group, True),
+                                        {'long_name': 'accumulated raw counts', 'units': '1'})
+    data_vars['numShots'] = (('time', 'channel'),
+                             np.array([[h.dataSet[i].numShots for i in indices] for _, h in headers]),
+                             {'long_name': 'number of accumulated laser shots', 'units': '1'})
+    data_vars['stop_time'] = (('time',), np.array([_times(h)[1] for _, h in headers]),
+                              {'long_name': 'end of the acquisition'})
+    for name in ('numShotsL0', 'repRateL0', 'numShotsL1', 'repRateL1'):
+        data_vars[name] = (('time',), np.array([getattr(h.GlobalInfo, name) for _, h in headers]),
+                           {'units': 'Hz' if name.startswith('repRate') else '1'})
+
+    coords.update({
+        'time': ('time', np.array([_times(h)[0] for _, h in headers]),
+                 {'standard_name': 'time', 'long_name': 'start of the acquisition', 'axis': 'T'}),
+        'channel': ('channel', [first.shortDescr[i] for i in indices]),
+        'range': ('range', longest.x_axis_m(),
+                  {'units': 'm', 'long_name': 'distance from the lidar', 'axis': 'Z'}),
+        'filename': ('time', [os.path.basename(f) for f in files]),
+    })
+    for name in _CHANNEL_FIELDS:
+        coords[name] = ('channel', [getattr(ds, name) for ds in selected], _CHANNEL_ATTRS.get(name, {}))
+    # the input range only applies to analog, the discriminator only to photon counting channels
+    analog = np.array([ds.dataType in (0, 2) for ds in selected])
+    coords['inputRange'] = ('channel', np.where(analog, coords['inputRange'][1], np.nan), coords['inputRange'][2])
+    coords['discriminator'] = ('channel', np.where(analog, np.nan, coords['discriminator'][1]),
+                               coords['discriminator'][2])
+
+    info = first.GlobalInfo
+    coords['latitude'] = ((), info.Latitude, {'standard_name': 'latitude', 'units': 'degrees_north'})
+    coords['longitude'] = ((), info.Longitude, {'standard_name': 'longitude', 'units': 'degrees_east'})
+    coords['altitude'] = ((), float(info.Height), {'standard_name': 'altitude', 'units': 'm',
+                                                   'long_name': 'height of the lidar above sea level'})
+    coords['zenith'] = ((), info.Zenith, {'standard_name': 'sensor_zenith_angle', 'units': 'degree'})
+    coords['azimuth'] = ((), info.Azimuth, {'standard_name': 'sensor_azimuth_angle', 'units': 'degree'})
+    attrs = {
+        'Conventions': 'CF-1.8',
+        'source': 'Licel data files',
+        'Location': info.Location,
+    }
+    return xr.Dataset(data_vars, coords, attrs)
+
+
+def to_netcdf(path, target: str, channels: Optional[Sequence[str]] = None, chunk_files: int = 32,
+              include_raw: bool = False, complevel: int = 4):
+    """Write Licel files as CF NetCDF without loading all of them.
+
+    The file is written one dask chunk (``chunk_files`` files) at a time,
+    ``time`` is an unlimited dimension and the data variables are compressed.
+    """
+    ds = open_dataset(path, channels, chunk_files, include_raw)
+    encoding = {}
+    for name, variable in ds.data_vars.items():
+        if variable.ndim == 3:
+            encoding[name] = {'zlib': True, 'complevel': complevel,
+                              'chunksizes': (min(chunk_files, ds.sizes['time']), 1, ds.sizes['range'])}
+    ds.to_netcdf(target, unlimited_dims=['time'], encoding=encoding)
+
+
+class LicelBackendEntrypoint(BackendEntrypoint):
+    """Allows ``xr.open_dataset(path, engine=LicelBackendEntrypoint)``."""
+    description = 'Open Licel data files'
+    open_dataset_parameters = ('filename_or_obj', 'drop_variables', 'channels', 'chunk_files', 'include_raw')
+
+    def open_dataset(self, filename_or_obj, *, drop_variables=None, channels=None, chunk_files=32,
+                     include_raw=False):
+        ds = open_dataset(os.fspath(filename_or_obj), channels, chunk_files, include_raw)
+        if drop_variables:
+            ds = ds.drop_vars(drop_variables)
+        return ds
+
+    def guess_can_open(self, filename_or_obj):
+        try:
+            LicelFileReader(os.fspath(filename_or_obj), readData=False)
+        except Exception:
+            return False
+        return True
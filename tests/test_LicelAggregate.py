@@ -0,0 +1,35 @@
+"""Time binned aggregation with sparse histogram states."""
+import numpy as np
+
+from LicelAggregate import AggregateSettings, ChannelState, SketchConfig, aggregate_files
+from LicelReader import GlobalInfo
+from LicelWriter import LicelFileWriter, new_dataset
+
+
+def _write(path, start, numBins, binWidth=7.5):
+    info = GlobalInfo(Location='Test', StartTime=start, StopTime=start, numShotsL0=600, repRateL0=10)
+    ds = new_dataset(dataType=1, numBins=numBins, binWidth=binWidth, wavelength=355, numShots=600,
+                     rawData=np.arange(numBins, dtype=np.uint32) + 100)
+    LicelFileWriter.write(str(path), info, [ds])
+    return str(path)
+
+
+def test_percentile_matches_numpy():
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(5, 1, (200, 50))
+    parts = [ChannelState.empty(SketchConfig(), np.arange(50.0)) for _ in range(2)]
+    for i, profile in enumerate(values):
+        parts[i % 2].add(profile)
+    state = parts[0].merge(parts[1])
+    assert state.cells.size < 50 * SketchConfig().numBins // 4
+    np.testing.assert_allclose(state.mean(), values.mean(axis=0))
+    for q in (25, 50, 75):
+        np.testing.assert_allclose(state.percentile(q), np.percentile(values, q, axis=0), rtol=0.1)
+
+
+def test_layout_change_within_time_bin(tmp_path):
+    files = [_write(tmp_path / 'a', '01/06/2024 10:00:00', 400),
+             _write(tmp_path / 'b', '01/06/2024 10:10:00', 400),
+             _write(tmp_path / 'c', '01/06/2024 10:20:00', 800, 3.75)]
+    results = aggregate_files(files, AggregateSettings(chunk_files=1), workers=1)
+    assert [(r.numBins, r.binWidth, int(r.count.max())) for r in results] == [(400, 7.5, 2), (800, 3.75, 1)]
@@ -0,0 +1,48 @@
+"""Reservations of the shared memory cache index."""
+import subprocess
+import sys
+
+import pytest
+
+from LicelCache import _CacheIndex
+
+
+def _dead_pid() -> int:
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return proc.pid
+
+
+@pytest.fixture
+def index():
+    index = _CacheIndex(1000)
+    yield index
+    index.clear()
+
+
+def test_commit_publishes_reservation(index):
+    name = index.reserve('a', 100, 1)
+    assert index.lookup('a') is None
+    index.commit('a', name, b'meta')
+    assert index.lookup('a') == {'name': name, 'meta': b'meta'}
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='pid check only on posix')
+def test_reservation_of_dead_client_is_dropped(index):
+    assert index.reserve('a', 800, _dead_pid()) is not None
+    # the key can be reserved again and the budget is free for other keys
+    assert index.reserve('b', 800) is not None
+    assert index.reserve('a', 100) is not None
+    assert index.stats()['used'] == 900
+
+
+def test_expired_reservation_is_dropped(index):
+    index.pending_timeout = 0.0
+    stale = index.reserve('a', 800)
+    name = index.reserve('a', 800)
+    assert name is not None and name != stale
+    # a late commit of the dropped reservation must not publish the new one
+    index.commit('a', stale, b'late')
+    assert index.lookup('a') is None
+    index.discard('a', stale)
+    assert index.stats()['entries'] == 1
@@ -0,0 +1,31 @@
+"""Trigger bin detection."""
+import numpy as np
+
+from LicelDetect import detect_t0
+
+NUM_BINS = 1000
+
+
+def _decay(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return 50 * np.exp(-np.arange(NUM_BINS) / 150.0)[None, :] + rng.normal(0, 0.5, (n, NUM_BINS)) + 2
+
+
+def test_trigger_rise_is_found():
+    batch = _decay(10)
+    batch[:, :37] = np.random.default_rng(1).normal(2, 0.5, (10, 37))
+    np.testing.assert_array_equal(detect_t0(batch), 37)
+
+
+def test_no_rise_gives_default():
+    batch = _decay(10)
+    np.testing.assert_array_equal(detect_t0(batch), 0)
+    np.testing.assert_array_equal(detect_t0(batch, default=12), 12)
+
+
+def test_near_range_count_noise_is_no_trigger():
+    # flat near range with large Poisson noise, then a steep decay
+    rng = np.random.default_rng(2)
+    r = np.maximum(np.arange(NUM_BINS) * 7.5, 30)
+    batch = rng.poisson(np.tile(5e4 / r ** 2 * 1e3 + 5, (10, 1))) / 10.0
+    np.testing.assert_array_equal(detect_t0(batch), 0)
@@ -0,0 +1,118 @@
+"""Equivalence of the batch kernels with the LicelUtil functions on all backends."""
+import numpy as np
+import pytest
+
+import LicelKernels
+from LicelKernels import available_backends, glue_batch, pr2_batch
+from LicelUtil import (GluingStrategy, bin_shift, check_gluing_strategy, deadtime_correction,
+                       glue_profiles, pr2, skip_first_bins)
+
+DEADTIME_NS = 3.08
+MIN_TOGGLE = 0.5
+MAX_TOGGLE = 20.0
+
+
+@pytest.fixture(params=available_backends())
+def backend(request):
+    previous = LicelKernels.get_backend()
+    LicelKernels.set_backend(request.param)
+    yield request.param
+    LicelKernels.set_backend(previous)
+
+
+def _profiles(n=6, numBins=600, seed=0, peak=100.0):
+    """Analog in V and observed photon counting in MHz of a decaying signal."""
+    rng = np.random.default_rng(seed)
+    j = np.arange(numBins)
+    rate = peak * np.exp(-j / 60.0)[None, :] * rng.uniform(0.5, 1.5, (n, 1)) + 0.2
+    analog = rate / 80.0 + rng.normal(0, 1e-4, (n, numBins))
+    pc = rate / (1 + rate * DEADTIME_NS * 0.001) + rng.normal(0, 0.01, (n, numBins))
+    return analog, np.abs(pc)
+
+
+def _reference_strategy(analog, pc, binshift, skip_bins):
+    analog_shifted, pc_shifted = bin_shift(analog, pc, binshift)
+    analog_sk, pc_sk = skip_first_bins(analog_shifted, deadtime_correction(pc_shifted, DEADTIME_NS), skip_bins)
+    return check_gluing_strategy(analog_sk, pc_sk, MIN_TOGGLE, MAX_TOGGLE)
+
+
+@pytest.mark.parametrize('deadtime_ns', [0.0, DEADTIME_NS])
+@pytest.mark.parametrize('t0', [0, 7])
+def test_pr2_batch_matches_pr2(backend, deadtime_ns, t0):
+    rng = np.random.default_rng(1)
+    raw = rng.integers(0, 5000, (5, 800)).astype(np.uint32)
+    scale = rng.uniform(1e-3, 2e-3, 5)
+    result = pr2_batch(raw, scale, t0, -300, -1, deadtime_ns)
+    for p in range(raw.shape[0]):
+        phys = scale[p] * raw[p]
+        if deadtime_ns > 0:
+            phys = deadtime_correction(phys, deadtime_ns)
+        np.testing.assert_allclose(result[p], pr2(phys, t0, -300, -1), rtol=1e-10)
+
+
+def test_pr2_batch_dead_time_too_large(backend):
+    with pytest.raises(ValueError):
+        pr2_batch(np.full((2, 10), 400, dtype=np.uint32), 1.0, 0, 5, 10, DEADTIME_NS)
+
+
+@pytest.mark.parametrize('binshift', [-3, 0, 4])
+@pytest.mark.parametrize('skip_bins', [0, 10])
+def test_glue_batch_matches_glue_profiles(backend, binshift, skip_bins):
+    analog, pc = _profiles()
+    glued, m, b, err, strategy = glue_batch(analog, pc, binshift, DEADTIME_NS, MIN_TOGGLE, MAX_TOGGLE, skip_bins)
+    for p in range(analog.shape[0]):
+        assert strategy[p] == GluingStrategy.GLUE_PROFILES
+        ref = glue_profiles(analog[p], pc[p], binshift, DEADTIME_NS, MIN_TOGGLE, MAX_TOGGLE, skip_bins)
+        np.testing.assert_allclose(glued[p], ref[0], rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose([m[p], b[p], err[p]], ref[4:7], rtol=1e-8, atol=1e-12)
+
+
+@pytest.mark.parametrize('scale, offset, expected', [
+    (1.0, 0.0, GluingStrategy.GLUE_PROFILES),
+    (1.0, 1500.0, GluingStrategy.INVALID),       # above 1000 MHz
+    (1.0, -5.0, GluingStrategy.INVALID),         # negative count rate
+    (1.0, 30.0, GluingStrategy.SIGNAL_TOO_LARGE),
+    (0.002, 0.0, GluingStrategy.SIGNAL_TOO_WEAK),
+    (0.1, 1.0, GluingStrategy.BACKGROUND),
+])
+def test_glue_batch_strategies(backend, scale, offset, expected):
+    analog, pc = _profiles(n=3)
+    pc = pc * scale + offset
+    glued, m, b, err, strategy = glue_batch(analog, pc, 2, 0.0 if offset > 1000 else DEADTIME_NS,
+                                            MIN_TOGGLE, MAX_TOGGLE, 5)
+    for p in range(analog.shape[0]):
+        if offset <= 1000:
+            assert _reference_strategy(analog[p], pc[p], 2, 5) == expected
+        assert strategy[p] == expected
+        if expected != GluingStrategy.GLUE_PROFILES:
+            assert m[p] == b[p] == err[p] == 0
+            if offset <= 1000:
+                np.testing.assert_allclose(glued[p], deadtime_correction(pc[p, :pc.shape[1] - 2], DEADTIME_NS))
+
+
+def test_glue_batch_without_bins_in_toggle_range(backend):
+    # classed as GLUE_PROFILES by the extremes, but no bin lies between the toggles
+    glued, m, b, err, strategy = glue_batch([[1, 2, 3, 4, 5, 6]], [[30, 30, 30, 1, 1, .1]], 0, 0, 10, 20)
+    assert strategy == [GluingStrategy.INVALID]
+    assert m[0] == b[0] == err[0] == 0
+    np.testing.assert_array_equal(glued[0], [30, 30, 30, 1, 1, .1])
+
+
+def test_glue_batch_backends_agree():
+    if len(available_backends()) < 2:
+        pytest.skip('numba not installed')
+    analog, pc = _profiles(n=20, seed=3)
+    pc[::4] *= 0.002
+    results = []
+    for name in available_backends():
+        previous = LicelKernels.get_backend()
+        LicelKernels.set_backend(name)
+        try:
+            results.append(glue_batch(analog, pc, 1, DEADTIME_NS, MIN_TOGGLE, MAX_TOGGLE, 3))
+        finally:
+            LicelKernels.set_backend(previous)
+    for a, b in zip(*results):
+        if isinstance(a, list):
+            assert a == b
+        else:
+            np.testing.assert_allclose(a, b, rtol=1e-8, atol=1e-12)
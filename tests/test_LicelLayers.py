@@ -0,0 +1,72 @@
+"""Layer detection on synthetic range corrected batches."""
+import numpy as np
+import pytest
+
+from LicelLayers import cloud_base, detect_layers, downsampled_batch, smoothed_batch
+from LicelUtil import downsampling, smoothed_signal
+
+NUM_PROFILES = 20
+X = np.arange(4000) * 7.5
+CLEAR = 1e4 * np.exp(-X / 4000)
+# background noise of the signal, scaled by r**2 in pr2; two sigma of the clear air at 8 km
+SIGMA = CLEAR[1067] / X[1067] ** 2 / 2
+
+
+def _batch(amplitude=0.0, seed=0):
+    rng = np.random.default_rng(seed)
+    bases = rng.uniform(2000, 7000, NUM_PROFILES)
+    cloud = (X >= bases[:, None]) & (X < bases[:, None] + 300)
+    noise = rng.normal(0, SIGMA, (NUM_PROFILES, X.size)) * np.maximum(X, 7.5) ** 2
+    return CLEAR * (1 + amplitude * cloud) + noise, bases
+
+
+@pytest.mark.parametrize('filterWidth', [4, 5])
+def test_smoothed_batch_matches_smoothed_signal(filterWidth):
+    batch = np.random.default_rng(1).normal(size=(3, 50))
+    for row, expected in zip(smoothed_batch(batch, filterWidth), batch):
+        np.testing.assert_allclose(row, smoothed_signal(expected, filterWidth))
+
+
+def test_downsampled_batch_matches_downsampling():
+    batch = np.random.default_rng(2).normal(size=(3, 50))
+    for row, expected in zip(downsampled_batch(batch, 2), batch):
+        np.testing.assert_allclose(row, downsampling(expected, 2))
+
+
+@pytest.mark.parametrize('method', ['gradient', 'threshold'])
+def test_clear_sky_has_no_layers(method):
+    batch, _ = _batch()
+    table = detect_layers(batch, X, method=method, threshold=8, filterWidth=5)
+    assert len(table) == 0
+    assert np.isnan(cloud_base(table, NUM_PROFILES)).all()
+
+
+@pytest.mark.parametrize('method', ['gradient', 'threshold'])
+@pytest.mark.parametrize('amplitude', [5, 20, 100])
+def test_strong_cloud_is_detected(method, amplitude):
+    batch, bases = _batch(amplitude)
+    table = detect_layers(batch, X, method=method, threshold=8, filterWidth=5)
+    base = cloud_base(table, NUM_PROFILES)
+    assert np.isfinite(base).all()
+    assert np.max(np.abs(base - bases)) < 60
+    if method == 'threshold':
+        # the gradient method may end a layer at any steep decay inside it
+        first = np.unique(table['profile'], return_index=True)[1]
+        assert np.all(table['top_m'][first] >= bases + 200)
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        detect_layers(np.ones((1, 10)), X[:10], method='wavelet')
+
+
+@pytest.mark.parametrize('amplitude', [0, 20])
+def test_overlap_rise_is_no_layer(amplitude):
+    batch, bases = _batch(amplitude)
+    overlap = np.clip(X / 300.0, 0, 1)
+    table = detect_layers(batch * overlap, X, threshold=8, filterWidth=5)
+    base = cloud_base(table, NUM_PROFILES)
+    if amplitude:
+        assert np.max(np.abs(base - bases)) < 60
+    else:
+        assert len(table) == 0
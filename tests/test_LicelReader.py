@@ -0,0 +1,109 @@
+"""Reading complete, header only and damaged Licel files."""
+import numpy as np
+import pytest
+
+from LicelReader import GlobalInfo, LicelFileReader
+from LicelValidate import check_file
+from LicelWriter import LicelFileWriter, new_dataset
+
+NUM_BINS = 100
+
+
+@pytest.fixture
+def licel_file(tmp_path):
+    info = GlobalInfo(Location='Test', StartTime='01/06/2024 10:00:00', StopTime='01/06/2024 10:01:00',
+                      numShotsL0=600, repRateL0=10)
+    dataSets = [new_dataset(dataType=0, numBins=NUM_BINS, wavelength=355, ADCBits=12, numShots=600,
+                            rawData=np.arange(NUM_BINS, dtype=np.uint32)),
+                new_dataset(dataType=1, numBins=NUM_BINS, wavelength=355, numShots=600,
+                            rawData=np.arange(NUM_BINS, dtype=np.uint32) * 2)]
+    path = str(tmp_path / 'a2461010.000000')
+    LicelFileWriter.write(path, info, dataSets)
+    return path
+
+
+def test_header_only_has_empty_data(licel_file):
+    file = LicelFileReader(licel_file, readData=False)
+    assert file.shortDescr == ['355 nm A', '355 nm PC']
+    for ds in file.dataSet:
+        assert ds.rawData.dtype == np.uint32 and ds.rawData.size == 0
+        assert ds.physData.dtype == np.float64 and ds.physData.size == 0
+
+
+def _damaged(licel_file, edit):
+    with open(licel_file, 'rb') as fp:
+        content = bytearray(fp.read())
+    offsets = LicelFileReader(licel_file, readData=False).dataset_offsets()
+    with open(licel_file, 'wb') as fp:
+        fp.write(edit(content, offsets))
+    return licel_file
+
+
+def _codes(diagnostics):
+    return [(d.code, d.severity, d.dataset) for d in diagnostics]
+
+
+def test_complete_file(licel_file):
+    file = LicelFileReader(licel_file)
+    assert file.complete and file.diagnostics == []
+    np.testing.assert_array_equal(file.dataSet[1].rawData, np.arange(NUM_BINS) * 2)
+    report = check_file(licel_file)
+    assert report.ok and report.diagnostics == [] and report.completeDataSets == 2
+    assert report.size == report.expectedSize == file.expected_file_size()
+
+
+def test_truncated_data(licel_file):
+    _damaged(licel_file, lambda c, offsets: c[:offsets[1] + 40])
+    with pytest.raises(EOFError):
+        LicelFileReader(licel_file)
+    file = LicelFileReader(licel_file, salvage=True)
+    assert len(file.dataSet) == 1 and not file.complete
+    assert _codes(file.diagnostics) == [('truncated', 'error', 1)]
+    report = check_file(licel_file)
+    assert report.completeDataSets == 1 and _codes(report.diagnostics) == [('truncated', 'error', 1)]
+
+
+def test_bad_separator(licel_file):
+    def edit(content, offsets):
+        content[offsets[1] - 2:offsets[1]] = b'XX'
+        return content
+    _damaged(licel_file, edit)
+    file = LicelFileReader(licel_file)
+    assert _codes(file.diagnostics) == [('separator', 'error', 1)]
+    assert _codes(check_file(licel_file).diagnostics) == [('separator', 'error', 1)]
+
+
+def test_missing_terminator(licel_file):
+    _damaged(licel_file, lambda c, offsets: c[:-2])
+    file = LicelFileReader(licel_file)
+    assert len(file.dataSet) == 2
+    assert _codes(file.diagnostics) == [('terminator', 'warning', -1)]
+    report = check_file(licel_file)
+    assert report.ok and _codes(report.diagnostics) == [('terminator', 'warning', -1)]
+
+
+def test_bad_descriptor(licel_file):
+    def edit(content, offsets):
+        lines = content.split(b'\r\n')
+        lines[4] = b' 1 1 1 0x100'
+        return b'\r\n'.join(lines)
+    _damaged(licel_file, edit)
+    with pytest.raises(ValueError):
+        LicelFileReader(licel_file)
+    file = LicelFileReader(licel_file, salvage=True)
+    assert len(file.dataSet) == 1
+    assert ('descriptor', 'error', 1) in _codes(file.diagnostics)
+    report = check_file(licel_file)
+    assert not report.ok and report.completeDataSets == 1
+
+
+@pytest.mark.parametrize('size', [0, 30, 100])
+def test_truncated_header(licel_file, size):
+    _damaged(licel_file, lambda c, offsets: c[:size])
+    with pytest.raises((ValueError, EOFError)):
+        LicelFileReader(licel_file)
+    file = LicelFileReader(licel_file, salvage=True)
+    assert file.dataSet == [] and not file.complete
+    assert _codes(file.diagnostics) == [('header', 'error', -1)]
+    report = check_file(licel_file)
+    assert not report.ok and _codes(report.diagnostics) == [('header', 'error', -1)]
@@ -0,0 +1,102 @@
+"""Byte exact round trip of the writer and merging of files."""
+import numpy as np
+import pytest
+
+from LicelReader import GlobalInfo, LicelFileReader
+from LicelWriter import LicelFileWriter, merge_files, new_dataset
+
+NUM_BINS = 64
+DESCRIPTORS = [
+    ' 1 0 1 00064 1 0850 7.50 00355.p 0 0 00 000 12 001200 0.500 BT0',
+    ' 1 1 1 00064 1 0850 7.50 00355.p 0 0 00 000 00 001200 3.1746 BC0 far range',
+    ' 1 0 2 00064 0 0900 3.75 01064.o 0 0 00 000 16 000600 0.100 BT1',
+    ' 1 4 1 00008 0 0000 0.00 00000.o 0 0 00 000 00 001200 0.000 PM0',
+    ' 1 5 1 00064 0 0000 7.50 00000.o 0 0 00 000 00 001200 0.500 BT2',
+]
+
+
+def _licel_bytes(name, minute=0, l2=True, seed=0):
+    """A file as the Licel software writes it, built without LicelWriter."""
+    rng = np.random.default_rng(seed)
+    lasers = '0001200 0020 0000600 0010 05' + (' 0001200 0020' if l2 else '')
+    lines = [f' {name}',
+             f' Munich 01/06/2024 10:{minute:02d}:00 01/06/2024 10:{minute:02d}:59 0530 11.6 48.1 0.0 0.0',
+             ' ' + lasers] + DESCRIPTORS
+    blocks = [rng.integers(0, 2 ** 30, NUM_BINS), rng.integers(0, 5000, NUM_BINS),
+              rng.integers(0, 2 ** 30, NUM_BINS), rng.integers(0, 1000, 8), np.arange(NUM_BINS) % 3]
+    data = b'\r\n'.join(np.asarray(b, dtype='<u4').tobytes() for b in blocks)
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode() + data + b'\r\n'
+
+
+@pytest.mark.parametrize('l2', [True, False])
+def test_round_trip_is_byte_exact(tmp_path, l2):
+    source = tmp_path / 'a2461010.000000'
+    source.write_bytes(_licel_bytes(source.name, l2=l2))
+    file = LicelFileReader(str(source))
+    assert file.complete and file.GlobalInfo.overflowDs == 4
+    assert file.GlobalInfo.numShotsL2 == (1200 if l2 else 0)
+    copy = tmp_path / 'copy' / source.name
+    copy.parent.mkdir()
+    LicelFileWriter.write(str(copy), file.GlobalInfo, file.dataSet)
+    assert copy.read_bytes() == source.read_bytes()
+    again = LicelFileReader(str(copy))
+    for a, b in zip(file.dataSet, again.dataSet):
+        np.testing.assert_array_equal(a.rawData, b.rawData)
+    np.testing.assert_array_equal(again.get_overflow_for_dataset(2), file.get_overflow_for_dataset(2))
+
+
+def test_incomplete_file_is_not_written(tmp_path):
+    target = tmp_path / 'a'
+    ds = new_dataset(dataType=1, numBins=4, wavelength=355)
+    with pytest.raises(ValueError):
+        with LicelFileWriter(str(target), GlobalInfo(Location='Test', StartTime='01/06/2024 10:00:00',
+                                                    StopTime='01/06/2024 10:00:00'), [ds, ds]) as writer:
+            writer.write_data(np.zeros(4, dtype=np.uint32))
+    assert list(tmp_path.iterdir()) == []
+
+
+def _sources(tmp_path, count=3):
+    names = []
+    for minute in range(count):
+        path = tmp_path / f'a24610{minute:02d}.000000'
+        path.write_bytes(_licel_bytes(path.name, minute, seed=minute))
+        names.append(str(path))
+    return names
+
+
+def test_merge_averages_physData(tmp_path):
+    names = _sources(tmp_path)
+    info = merge_files(names, str(tmp_path / 'merged'))
+    assert (info.StartTime, info.StopTime) == ('01/06/2024 10:00:00', '01/06/2024 10:02:59')
+    assert (info.numShotsL0, info.numShotsL2) == (3600, 3600)
+    merged = LicelFileReader(str(tmp_path / 'merged'))
+    files = [LicelFileReader(n) for n in names]
+    for i in (0, 1, 2):
+        np.testing.assert_allclose(merged.dataSet[i].physData,
+                                   np.mean([f.dataSet[i].physData for f in files], axis=0))
+    assert merged.dataSet[3].numBins == 24
+    np.testing.assert_array_equal(merged.dataSet[4].rawData, files[0].dataSet[4].rawData)
+
+
+def test_merge_combines_photon_counting_bins(tmp_path):
+    names = []
+    for minute in range(2):
+        info = GlobalInfo(Location='Test', StartTime=f'01/06/2024 10:0{minute}:00',
+                          StopTime=f'01/06/2024 10:0{minute}:59', numShotsL0=600, repRateL0=10)
+        ds = new_dataset(dataType=1, numBins=NUM_BINS, wavelength=355, numShots=600,
+                         rawData=np.arange(NUM_BINS, dtype=np.uint32) + minute)
+        names.append(str(tmp_path / f'b{minute}'))
+        LicelFileWriter.write(names[-1], info, [ds])
+    merge_files(names, str(tmp_path / 'merged'), exponent=1)
+    merged = LicelFileReader(str(tmp_path / 'merged')).dataSet[0]
+    first = LicelFileReader(names[0]).dataSet[0]
+    assert (merged.numBins, merged.binWidth) == (NUM_BINS // 2, 15.0)
+    # the count rate of a bin of twice the width is the mean rate of the two bins and both files
+    expected = first.physData.reshape(-1, 2).mean(axis=1) + 0.5 * first.phys_scale()
+    np.testing.assert_allclose(merged.physData, expected)
+
+
+def test_merge_rejects_analog_bin_combination(tmp_path):
+    with pytest.raises(ValueError, match='analog'):
+        merge_files(_sources(tmp_path, 2), str(tmp_path / 'merged'), exponent=1)
+    assert not (tmp_path / 'merged').exists()
@@ -0,0 +1,46 @@
+"""CF layout of the xarray view."""
+import numpy as np
+import pytest
+
+from LicelReader import GlobalInfo, LicelFileReader
+from LicelWriter import LicelFileWriter, new_dataset
+
+xr = pytest.importorskip('xarray')
+from LicelXarray import open_dataset, to_netcdf  # noqa: E402
+
+NUM_BINS = 50
+
+
+@pytest.fixture
+def directory(tmp_path):
+    for minute in range(3):
+        time = f'01/06/2024 10:{minute:02d}:00'
+        info = GlobalInfo(Location='Test', StartTime=time, StopTime=time, Height=120,
+                          Longitude=11.5, Latitude=48.1, numShotsL0=600, repRateL0=10)
+        dataSets = [new_dataset(dataType=0, numBins=NUM_BINS, wavelength=355, ADCBits=12, numShots=600,
+                                inputRange=0.1, rawData=np.arange(NUM_BINS, dtype=np.uint32) + minute),
+                    new_dataset(dataType=1, numBins=NUM_BINS, wavelength=355, numShots=600, discriminator=4.0,
+                                rawData=np.arange(NUM_BINS, dtype=np.uint32) * 2)]
+        LicelFileWriter.write(str(tmp_path / f'a24610{minute:02d}.000000'), info, dataSets)
+    return tmp_path
+
+
+def test_signals_have_units(directory):
+    ds = open_dataset(str(directory))
+    assert ds.analog.attrs['units'] == 'V'
+    assert ds.photon_counting.attrs['units'] == 'MHz'
+    file = LicelFileReader(str(directory / 'a2461000.000000'))
+    np.testing.assert_allclose(ds.analog.isel(time=0, analog_channel=0), file.dataSet[0].physData)
+    np.testing.assert_allclose(ds.photon_counting.isel(time=0, photon_counting_channel=0), file.dataSet[1].physData)
+    np.testing.assert_array_equal(ds.inputRange, [0.1, np.nan])
+    np.testing.assert_array_equal(ds.discriminator, [np.nan, 4.0])
+
+
+def test_position_is_cf(directory, tmp_path):
+    pytest.importorskip('netCDF4')
+    target = str(tmp_path / 'out.nc')
+    to_netcdf(str(directory), target)
+    with xr.open_dataset(target) as ds:
+        assert ds.latitude.attrs == {'standard_name': 'latitude', 'units': 'degrees_north'}
+        assert float(ds.longitude) == 11.5 and float(ds.altitude) == 120
+        assert ds.analog.sizes == {'time': 3, 'analog_channel': 1, 'range': NUM_BINS}